@@ -1,4 +1,17 @@
-import six
+import logging
+import numbers
+import threading
+import time
+
+from phlawg import scope as _scope
+from phlawg.scope import MetricScope
+
+METRIC_LOGGER_CACHE_SIZE = 1024
+
+_metric_filter = None
+
+_metric_loggers = {}
+_metric_loggers_lock = threading.Lock()
 
 class MetricLogger(object):
     """A wrapper class for logging.Loggers for metric propagation through log streams.
@@ -28,6 +41,12 @@ class MetricLogger(object):
 
     Extend MetricLogger and override `message` and or `extra` to control how the log lines
     are formatted.
+
+    Within a :class:`phlawg.MetricScope`, metrics are captured by the scope rather than
+    logged immediately; see :mod:`phlawg.scope`.
+
+    Metrics disabled by the metric filter installed with :func:`set_metric_filter` are
+    dropped before any formatting; see :mod:`phlawg.metricfilter`.
     """
 
     def __init__(self, logger):
@@ -36,8 +55,21 @@ class MetricLogger(object):
 
     def message_and_extra(self, metrics):
         """For each metric/value pair in `metrics`, yields the log message and 'extra' dictionary."""
-        for name, value in six.iteritems(metrics):
-            yield self.message(name, value), self.extra(name, value)
+        metric_filter = _metric_filter
+        for name, value in metrics.items():
+            if metric_filter is None or metric_filter.allows(self.logger.name, name):
+                yield self.message(name, value), self.extra(name, value)
+
+    def metric_enabled(self, name):
+        """Returns whether the metric `name` is enabled by the installed metric filter."""
+        metric_filter = _metric_filter
+        return metric_filter is None or metric_filter.allows(self.logger.name, name)
+
+    def emittable(self, name, value):
+        """Returns whether the metric `name` should be emitted with `value`; this is
+        consulted for each metric captured by a MetricScope.  By default, a metric is
+        emittable if enabled (see :meth:`metric_enabled`)."""
+        return self.metric_enabled(name)
 
     def message(self, name, value):
         """Formats and returns a log message string for the metric name,value pair"""
@@ -48,44 +80,237 @@ class MetricLogger(object):
         name,value metric pair."""
         return {'metric': name, 'value': value}
 
+    def accumulate(self, previous, value):
+        """Combines two values for the same metric captured within a MetricScope.
+
+        Numeric values are summed; otherwise (booleans included) the later value wins."""
+        if (isinstance(previous, numbers.Number) and isinstance(value, numbers.Number)
+                and not isinstance(previous, bool) and not isinstance(value, bool)):
+            return previous + value
+        return value
+
+    def consolidated_message_and_extra(self, metrics, tags):
+        """Returns the log message and 'extra' dictionary for the single record emitted
+        for all the `metrics` captured by a MetricScope with the given `tags`."""
+        msg = ' '.join(self.message(name, value) for name, value in metrics.items())
+        return msg, {'metrics': dict(metrics), 'scope': dict(tags)}
+
 
     def log(self, level, **metrics):
         """Log the metrics expressed in keyword arguments using the specified log `level`."""
+        scope = _scope.current()
+        if scope is not None and scope.capture(self, self.logger.log, (level,), metrics):
+            return
         for msg, xtra in self.message_and_extra(metrics):
             self.logger.log(level, msg, extra=xtra)
 
 
-    def _level_emit(self, emitter, metrics):
+    def summary_message(self, name, summary):
+        """Formats and returns a log message string summarizing an array of values for
+        metric `name`; `summary` is as returned by :func:`phlawg.arrays.summarize`."""
+        return "%s=%s" % (name, ' '.join(
+            '%s:%s' % (key, summary[key]) for key in sorted(summary)))
+
+    def summary_extra(self, name, summary):
+        """Returns the 'extra' dictionary for a record summarizing an array of values for
+        metric `name`.  The mean is given as the value."""
+        return {'metric': name, 'value': summary['mean'], 'summary': summary}
+
+    def log_array(self, level, name, values, summarize=True, quantiles=None):
+        """Log an array of observations `values` for metric `name` at the given `level`.
+
+        `values` may be any sequence of numbers, or a NumPy array.  By default, a single
+        record is emitted summarizing the values (count, sum, min, max, mean and the
+        requested `quantiles`, which default to
+        :data:`phlawg.arrays.DEFAULT_QUANTILES`); for NumPy arrays the summary is
+        computed with vectorized operations.  Nothing is emitted for empty `values`.
+
+        With `summarize` false, each value is instead emitted as its own record, as if
+        passed individually to `log`, but without repeating the per-call overhead.
+
+        Records are emitted directly, and are not captured by a MetricScope.
+        """
+        if not (self.logger.isEnabledFor(level) and self.metric_enabled(name)):
+            return
+        from phlawg import arrays
+        if summarize:
+            if quantiles is None:
+                quantiles = arrays.DEFAULT_QUANTILES
+            summary = arrays.summarize(values, quantiles)
+            if summary is not None:
+                self.logger.log(level, self.summary_message(name, summary),
+                                extra=self.summary_extra(name, summary))
+            return
+        emit = self.logger.log
+        message = self.message
+        extra = self.extra
+        for value in arrays.as_list(values):
+            emit(level, message(name, value), extra=extra(name, value))
+
+
+    def _level_emit(self, emitter, level, metrics):
+        scope = _scope.current()
+        if scope is not None and scope.capture(self, emitter, (), metrics):
+            return
         for msg, xtra in self.message_and_extra(metrics):
             emitter(msg, extra=xtra)
 
     def critical(self, **metrics):
         """Log the metrics expressed in keyword arguments at logging.CRITICAL level."""
-        return self._level_emit(self.logger.critical, metrics)
+        return self._level_emit(self.logger.critical, logging.CRITICAL, metrics)
 
     def debug(self, **metrics):
         """Log the metrics expressed in keyword arguments at logging.DEBUG level."""
-        return self._level_emit(self.logger.debug, metrics)
+        return self._level_emit(self.logger.debug, logging.DEBUG, metrics)
 
     def error(self, **metrics):
         """Log the metrics expressed in keyword arguments at logging.ERROR level."""
-        return self._level_emit(self.logger.error, metrics)
+        return self._level_emit(self.logger.error, logging.ERROR, metrics)
 
     def fatal(self, **metrics):
         """Log the metrics expressed in keyword arguments at logging.CRITICAL level."""
-        return self._level_emit(self.logger.fatal, metrics)
+        return self._level_emit(self.logger.fatal, logging.CRITICAL, metrics)
 
     def info(self, **metrics):
         """Log the metrics expressed in keyword arguments at logging.INFO level."""
-        return self._level_emit(self.logger.info, metrics)
+        return self._level_emit(self.logger.info, logging.INFO, metrics)
 
     def warn(self, **metrics):
         """Log the metrics expressed in keyword arguments at logging.WARN level."""
-        return self._level_emit(self.logger.warn, metrics)
+        return self._level_emit(self.logger.warn, logging.WARN, metrics)
 
     def warning(self, **metrics):
         """Log the metrics expressed in keyword arguments at logging.WARN level."""
-        return self._level_emit(self.logger.warning, metrics)
+        return self._level_emit(self.logger.warning, logging.WARNING, metrics)
+
+
+def level_handled(logger, level):
+    """Returns whether a record of `level` logged to `logger` would be taken by
+    at least one handler.
+
+    Beyond :meth:`logging.Logger.isEnabledFor`, this compares `level` against the
+    levels of the handlers reached by walking up the logger hierarchy, since
+    phlawg's configuration (see :mod:`phlawg.config`) puts levels on handlers
+    rather than on loggers.  For logger-like objects other than
+    :class:`logging.Logger`, only `isEnabledFor` is consulted.
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    if not isinstance(logger, logging.Logger):
+        return True
+    found = False
+    current = logger
+    while current is not None:
+        for handler in current.handlers:
+            found = True
+            if level >= handler.level:
+                return True
+        if not current.propagate:
+            break
+        current = current.parent
+    if not found:
+        last_resort = getattr(logging, 'lastResort', None)
+        return last_resort is not None and level >= last_resort.level
+    return False
+
+
+class GaugeLogger(MetricLogger):
+    """A MetricLogger for gauges that only emits a metric when its value changes.
+
+    Gauges polled at a high rate (queue sizes, pool sizes) are usually flat, so
+    most of what they would emit is redundant.  A GaugeLogger remembers the last
+    value it emitted for each metric name and suppresses a new value that is
+    equal to it, or, for numeric values, within `epsilon` of it.
+
+    So that downstream consumers never see gaps that look like missing data, an
+    unchanged value is nevertheless re-emitted once `heartbeat` seconds have
+    passed since the metric was last emitted.  A `heartbeat` of ``None``
+    disables this.
+
+    Suppression is decided per metric name, regardless of the level at which
+    the metric is logged; values logged at levels no handler would take (see
+    :func:`level_handled`) are neither emitted nor remembered.  Within a MetricScope, suppression applies as metrics
+    are captured, and a gauge captured more than once keeps its latest value.
+    """
+
+    def __init__(self, logger, epsilon=0, heartbeat=60.0, clock=time.time):
+        """Wrap `logger`, suppressing changes of at most `epsilon` until the
+        `heartbeat` interval (in seconds, per `clock`) elapses."""
+        super(GaugeLogger, self).__init__(logger)
+        self.epsilon = epsilon
+        self.heartbeat = heartbeat
+        self.clock = clock
+        self.last_emitted = {}
+        self.lock = threading.Lock()
+
+    def unchanged(self, previous, value):
+        """Returns ``True`` if `value` is not a meaningful change from `previous`."""
+        if previous == value:
+            return True
+        try:
+            return abs(value - previous) <= self.epsilon
+        except TypeError:
+            return False
+
+    def should_emit(self, name, value):
+        """Decides whether the metric `name` should be emitted with `value`,
+        recording it as emitted if so."""
+        now = self.clock()
+        with self.lock:
+            last = self.last_emitted.get(name)
+            if last is not None:
+                previous, emitted_at = last
+                if self.unchanged(previous, value) and (
+                        self.heartbeat is None
+                        or now - emitted_at < self.heartbeat):
+                    return False
+            self.last_emitted[name] = (value, now)
+        return True
+
+    def log(self, level, **metrics):
+        """As with :meth:`MetricLogger.log`, but nothing is done (or remembered)
+        if no handler would take a record of `level` (see :func:`level_handled`)."""
+        if level_handled(self.logger, level):
+            return super(GaugeLogger, self).log(level, **metrics)
+
+    def _level_emit(self, emitter, level, metrics):
+        if level_handled(self.logger, level):
+            return super(GaugeLogger, self)._level_emit(emitter, level, metrics)
+
+    def emittable(self, name, value):
+        """Returns whether the metric `name` is enabled and should be emitted
+        with `value` (see :meth:`should_emit`)."""
+        return self.metric_enabled(name) and self.should_emit(name, value)
+
+    def accumulate(self, previous, value):
+        """Gauges are levels, not counts: the later value wins."""
+        return value
+
+    def message_and_extra(self, metrics):
+        """As with :meth:`MetricLogger.message_and_extra`, but skipping metrics
+        whose value has not changed since last emitted."""
+        for name, value in metrics.items():
+            if self.emittable(name, value):
+                yield self.message(name, value), self.extra(name, value)
+
+
+def record_metrics(record):
+    """Returns the metrics carried by the log `record`, for handlers consuming
+    metric records directly, as a list of ``(metric, value, summary)`` triples.
+
+    Records from a :class:`MetricLogger` carry a single metric and value, except
+    those consolidated by a :class:`MetricScope`, which carry a dictionary of
+    them.  For records summarizing an array of values (see
+    :meth:`MetricLogger.log_array`), the value is the mean and `summary` is the
+    summary; it is ``None`` otherwise.  Other records carry no metrics.
+    """
+    metrics = getattr(record, 'metrics', None)
+    if metrics is not None:
+        return [(metric, value, None) for metric, value in metrics.items()]
+    metric = getattr(record, 'metric', None)
+    if metric is None:
+        return []
+    return [(metric, record.value, getattr(record, 'summary', None))]
 
 
 def to_metric_logger_name(logger_or_name):
@@ -127,3 +352,49 @@ def to_metric_logger_name(logger_or_name):
         return 'metrics'
 
 
+def get_metric_logger(logger_or_name):
+    """Returns a :class:`MetricLogger` for the metric logger name of `logger_or_name`.
+
+    This is equivalent to::
+
+        MetricLogger(logging.getLogger(to_metric_logger_name(logger_or_name)))
+
+    except that the result is cached by name, so repeated calls (say, per request)
+    skip the name translation, the `logging` module lock and the allocation.  Like
+    `logging.getLogger`, calls with the same name return the same object.
+
+    The cache holds up to :data:`METRIC_LOGGER_CACHE_SIZE` names, and is emptied
+    when it fills up and whenever logging is reconfigured via
+    :func:`phlawg.config.from_environment`.
+    """
+    name = getattr(logger_or_name, 'name', logger_or_name)
+    metric_logger = _metric_loggers.get(name)
+    if metric_logger is None:
+        with _metric_loggers_lock:
+            metric_logger = _metric_loggers.get(name)
+            if metric_logger is None:
+                if len(_metric_loggers) >= METRIC_LOGGER_CACHE_SIZE:
+                    _metric_loggers.clear()
+                metric_logger = MetricLogger(
+                        logging.getLogger(to_metric_logger_name(name)))
+                _metric_loggers[name] = metric_logger
+    return metric_logger
+
+
+def clear_metric_logger_cache():
+    """Empties the cache used by :func:`get_metric_logger`."""
+    with _metric_loggers_lock:
+        _metric_loggers.clear()
+
+
+def set_metric_filter(metric_filter):
+    """Installs `metric_filter` (see :class:`phlawg.metricfilter.MetricFilter`) as the
+    filter consulted by every MetricLogger, replacing any previous one; ``None``
+    removes it."""
+    global _metric_filter
+    _metric_filter = metric_filter
+
+
+def get_metric_filter():
+    """Returns the installed metric filter, or ``None``."""
+    return _metric_filter
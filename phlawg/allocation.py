@@ -0,0 +1,211 @@
+"""
+Allocation profiling for the metric emission hot path.
+
+Uses :mod:`tracemalloc` to measure the memory allocated per metric emission at
+each stage of the path a metric takes: :meth:`phlawg.MetricLogger.message_and_extra`,
+:meth:`phlawg.MetricLogger._level_emit` and the configured metric formatter.
+For each stage, an :class:`AllocationReport` gives, per emission:
+
+    ``bytes``, ``blocks``: memory, and the number of memory blocks (roughly,
+        objects), allocated by the emission and still alive afterward; that
+        is, what the emission produced, plus anything it leaked or cached.
+
+    ``peak_bytes``: the largest amount of memory held at any point during the
+        emission, including temporaries freed before it returned.
+
+The test suite can assert budgets for these with :func:`assert_allocation_budget`,
+and the profile of the current configuration can be reported with:
+
+    python -m phlawg.allocation [--iterations N] [--metrics N] [package]
+
+Allocations made by this module itself are excluded from ``bytes`` and
+``blocks``.  Requires python 3.4+ (and 3.9+ for exact ``peak_bytes``).
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import logging
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import phlawg
+from phlawg import config
+
+STAGES = ('message_and_extra', '_level_emit', 'formatter')
+
+
+class AllocationReport(object):
+    """Per-emission allocations of one stage, over `iterations` emissions."""
+
+    def __init__(self, stage, iterations, bytes, blocks, peak_bytes):
+        self.stage = stage
+        self.iterations = iterations
+        self.bytes = bytes
+        self.blocks = blocks
+        self.peak_bytes = peak_bytes
+
+    def __repr__(self):
+        return '%s(%r, bytes=%.1f, blocks=%.2f, peak_bytes=%d)' % (
+            type(self).__name__, self.stage, self.bytes, self.blocks,
+            self.peak_bytes)
+
+
+def _require_tracemalloc():
+    if tracemalloc is None:
+        raise RuntimeError('allocation profiling requires tracemalloc')
+
+
+def _peak_of(fn):
+    """Returns the peak traced memory above the starting level during `fn()`."""
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        fn()
+        return tracemalloc.get_traced_memory()[1] - start
+    # Without reset_peak, the peak is only reset by restarting tracing; this
+    # also forgets what was traced before, so the result is approximate.
+    tracemalloc.stop()
+    tracemalloc.start()
+    fn()
+    return tracemalloc.get_traced_memory()[1]
+
+
+def measure(fn, iterations=1000, stage=None, warmup=10):
+    """Measures the allocations made per call of `fn` (which takes no arguments),
+    over `iterations` calls, returning an :class:`AllocationReport`.
+
+    The return value of each call is kept alive until measurement is complete,
+    so that what `fn` produces is counted.
+    """
+    _require_tracemalloc()
+    for _ in range(warmup):
+        fn()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        results = [None] * iterations
+        exclude = [tracemalloc.Filter(False, __file__),
+                   tracemalloc.Filter(False, tracemalloc.__file__)]
+        before = tracemalloc.take_snapshot().filter_traces(exclude)
+        for i in range(iterations):
+            results[i] = fn()
+        after = tracemalloc.take_snapshot().filter_traces(exclude)
+        stats = after.compare_to(before, 'filename')
+        size = sum(stat.size_diff for stat in stats)
+        count = sum(stat.count_diff for stat in stats)
+        del results
+        peak = max(_peak_of(fn) for _ in range(min(iterations, 100)))
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    return AllocationReport(
+        stage, iterations, size / float(iterations), count / float(iterations),
+        peak)
+
+
+def _emitter(msg, extra=None):
+    return msg, extra
+
+
+def stage_functions(metric_logger, metrics, formatter=None):
+    """Returns a dict of stage name to a function emitting `metrics` through
+    that stage of `metric_logger`; the "formatter" stage is only included if a
+    `formatter` is given."""
+    msg, xtra = next(metric_logger.message_and_extra(metrics))
+    record = logging.makeLogRecord(dict(
+        xtra, name=metric_logger.logger.name, msg=msg, levelno=logging.INFO,
+        levelname='INFO'))
+    stages = {
+        'message_and_extra': lambda: list(metric_logger.message_and_extra(metrics)),
+        '_level_emit': lambda: metric_logger._level_emit(_emitter, logging.INFO, metrics),
+        }
+    if formatter is not None:
+        stages['formatter'] = lambda: formatter.format(record)
+    return stages
+
+
+def profile(metric_logger, metrics, formatter=None, iterations=1000):
+    """Measures each stage of emitting `metrics` through `metric_logger`, with
+    `formatter` as the formatter; returns a list of :class:`AllocationReport`,
+    one per stage, with bytes and blocks given per metric emitted."""
+    reports = []
+    functions = stage_functions(metric_logger, metrics, formatter)
+    for stage in STAGES:
+        if stage in functions:
+            report = measure(functions[stage], iterations, stage)
+            if stage != 'formatter':
+                report.bytes /= len(metrics)
+                report.blocks /= len(metrics)
+            reports.append(report)
+    return reports
+
+
+def assert_allocation_budget(fn, bytes=None, blocks=None, peak_bytes=None,
+                             iterations=1000):
+    """Asserts that each call of `fn` stays within the given allocation budget
+    (see :class:`AllocationReport`); budgets of ``None`` are not checked.
+
+    Returns the :class:`AllocationReport`.
+    """
+    report = measure(fn, iterations)
+    for name, budget in (('bytes', bytes), ('blocks', blocks),
+                         ('peak_bytes', peak_bytes)):
+        actual = getattr(report, name)
+        if budget is not None and actual > budget:
+            raise AssertionError(
+                'allocation budget exceeded: %s per call is %s, budget is %s'
+                % (name, actual, budget))
+    return report
+
+
+def configured_formatter(logger):
+    """Returns the formatter of the first handler of `logger` having one,
+    unwrapping lazily built formatters, or ``None``."""
+    for handler in logger.handlers:
+        formatter = handler.formatter
+        if formatter is not None:
+            return getattr(formatter, 'delegate', lambda: formatter)()
+    return None
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m phlawg.allocation',
+        description='Report allocations per metric emission, per stage.')
+    p.add_argument('package', nargs='?', default='allocation',
+                   help='Package name whose metric logger is profiled '
+                        '(default: %(default)s).')
+    p.add_argument('--iterations', type=int, default=1000,
+                   help='Emissions measured per stage (default: %(default)s).')
+    p.add_argument('--metrics', type=int, default=1,
+                   help='Metrics per emission call (default: %(default)s).')
+    return p
+
+
+def main(argv=None, out=None):
+    _require_tracemalloc()
+    options = parser().parse_args(argv)
+    out = out or sys.stdout
+    config.from_environment(options.package)
+    metric_logger = phlawg.get_metric_logger(options.package)
+    metrics = dict(('metric_%d' % i, i * 1.5) for i in range(options.metrics))
+    reports = profile(metric_logger, metrics,
+                      configured_formatter(metric_logger.logger),
+                      options.iterations)
+    print('%-20s %12s %12s %12s' % ('stage', 'bytes', 'blocks', 'peak_bytes'),
+          file=out)
+    for report in reports:
+        print('%-20s %12.1f %12.2f %12d' % (
+            report.stage, report.bytes, report.blocks, report.peak_bytes),
+            file=out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
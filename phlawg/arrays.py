@@ -0,0 +1,92 @@
+"""
+Summary statistics for arrays of metric observations.
+
+Used by :meth:`phlawg.MetricLogger.log_array`.  NumPy arrays (anything with a
+``dtype``) are summarized with vectorized NumPy operations; other sequences are
+summarized in pure Python.  NumPy is never imported by this module unless the
+caller has already handed it a NumPy array.
+"""
+
+from __future__ import absolute_import
+
+import math
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def is_numpy(values):
+    return hasattr(values, 'dtype') and hasattr(values, 'tolist')
+
+
+def quantile_label(q):
+    """Returns the label used for quantile `q`, e.g. "p50" for 0.5 and "p99.9"
+    for 0.999."""
+    return 'p%s' % ('%f' % (q * 100)).rstrip('0').rstrip('.')
+
+
+def interpolated_quantile(ordered, q):
+    """Returns quantile `q` of the sorted sequence `ordered`, interpolating
+    linearly between closest ranks (as NumPy does by default)."""
+    position = (len(ordered) - 1) * q
+    lower = int(math.floor(position))
+    upper = int(math.ceil(position))
+    if lower == upper:
+        return ordered[lower]
+    fraction = position - lower
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * fraction
+
+
+def summarize_numpy(values, quantiles):
+    import numpy
+    values = numpy.ravel(values)
+    total = values.sum()
+    result = {
+        'count': int(values.size),
+        'sum': total.item(),
+        'min': values.min().item(),
+        'max': values.max().item(),
+        'mean': (total / values.size).item(),
+        }
+    if quantiles:
+        points = numpy.percentile(values, [q * 100 for q in quantiles])
+        for q, point in zip(quantiles, points.tolist()):
+            result[quantile_label(q)] = point
+    return result
+
+
+def summarize_sequence(values, quantiles):
+    ordered = sorted(values)
+    total = sum(ordered)
+    result = {
+        'count': len(ordered),
+        'sum': total,
+        'min': ordered[0],
+        'max': ordered[-1],
+        'mean': total / float(len(ordered)),
+        }
+    for q in quantiles:
+        result[quantile_label(q)] = interpolated_quantile(ordered, q)
+    return result
+
+
+def summarize(values, quantiles=DEFAULT_QUANTILES):
+    """Summarizes `values` as a dictionary with 'count', 'sum', 'min', 'max' and
+    'mean' members, plus one member per quantile in `quantiles` (labeled per
+    :func:`quantile_label`).
+
+    Returns ``None`` if `values` is empty.
+    """
+    if is_numpy(values):
+        if values.size == 0:
+            return None
+        return summarize_numpy(values, quantiles)
+    if len(values) == 0:
+        return None
+    return summarize_sequence(values, quantiles)
+
+
+def as_list(values):
+    """Returns `values` as a list of plain Python scalars."""
+    if is_numpy(values):
+        return values.ravel().tolist()
+    return list(values)
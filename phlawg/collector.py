@@ -0,0 +1,163 @@
+"""
+Collector for the shared-memory ring buffer metric transport.
+
+Drains the metric rings written by :class:`phlawg.ring.RingHandler` in all
+processes sharing a ring directory, formats the records as JSON with the same
+formatter and fields in-process metric logging would use, and writes them to
+a stream (STDOUT by default):
+
+    PHLAWG_METRIC_RING_DIR=/dev/shm/myapp python -m phlawg.collector
+
+Rings closed by their writers (as when a process reconfigures its logging) or
+of processes that have exited are removed once drained.  Records dropped
+by a process because its ring was full are reported by the collector as the
+"dropped" metric of the "phlawg.metrics.collector" logger.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import errno
+import glob
+import logging
+import os
+import sys
+import time
+
+from phlawg import config
+from phlawg import ring
+
+COLLECTOR_LOGGER_NAME = 'phlawg.metrics.collector'
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def metric_formatter():
+    """Returns the JSON metric formatter configured per the environment."""
+    from phlawg import formatter
+    env = config.EnvConf()
+    fields = env.metric_fields or config.DEFAULT_METRIC_FIELDS
+    return formatter.MetricFormatter(config.metric_field_format(fields),
+                                     datefmt=env.metric_date_format)
+
+
+def log_record(name, metric, levelno, value, created, process, thread):
+    record = logging.LogRecord(
+        name, levelno, '', 0, '%s=%s', (metric, value), None)
+    record.created = created
+    record.msecs = (created - int(created)) * 1000
+    record.relativeCreated = 0
+    record.process = process
+    record.thread = thread
+    record.threadName = None
+    record.processName = None
+    record.metric = metric
+    record.value = value
+    return record
+
+
+class Collector(object):
+    """Drains the rings in `directory`, writing formatted records to `out`."""
+
+    def __init__(self, directory, out, formatter=None):
+        self.directory = directory
+        self.out = out
+        self.formatter = formatter or metric_formatter()
+        self.readers = {}
+        self.reported_drops = {}
+
+    def discover(self):
+        for path in glob.glob(os.path.join(self.directory, '*' + ring.RING_SUFFIX)):
+            if path not in self.readers:
+                try:
+                    self.readers[path] = ring.RingReader(path)
+                except (ValueError, OSError, IOError):
+                    # Not yet initialized by its writer, or not a ring.
+                    continue
+
+    def write(self, record):
+        self.out.write(self.formatter.format(record))
+        self.out.write('\n')
+
+    def report_drops(self, reader):
+        dropped = reader.dropped()
+        reported = self.reported_drops.get(reader.path, 0)
+        if dropped > reported:
+            self.reported_drops[reader.path] = dropped
+            self.write(log_record(
+                COLLECTOR_LOGGER_NAME, 'dropped', logging.WARNING,
+                dropped - reported, time.time(), reader.pid, 0))
+
+    def collect_once(self):
+        """Drains all rings once, returning the number of records written."""
+        self.discover()
+        count = 0
+        for path, reader in list(self.readers.items()):
+            # Checked before draining, so nothing written after is missed.
+            finished = reader.closed() or not process_exists(reader.pid)
+            for rec in reader.drain():
+                self.write(log_record(rec.name, rec.metric, rec.levelno,
+                                      rec.value, rec.created, rec.process,
+                                      rec.thread))
+                count += 1
+            self.report_drops(reader)
+            if finished and reader.pending() == 0:
+                reader.remove()
+                del self.readers[path]
+                self.reported_drops.pop(path, None)
+        self.out.flush()
+        return count
+
+    def run(self, interval=0.1):
+        """Collects until interrupted, sleeping `interval` seconds whenever
+        there is nothing to collect."""
+        while True:
+            if not self.collect_once():
+                time.sleep(interval)
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m phlawg.collector',
+        description='Collect metrics from phlawg ring buffers as JSON lines.')
+    p.add_argument('directory', nargs='?',
+                   default=os.getenv(config.EnvConf.METRIC_RING_DIR_VAR),
+                   help='Ring directory (default: $%s).'
+                        % config.EnvConf.METRIC_RING_DIR_VAR)
+    p.add_argument('--interval', type=float, default=0.1,
+                   help='Seconds to sleep when idle (default: %(default)s).')
+    p.add_argument('--once', action='store_true',
+                   help='Drain the rings once and exit.')
+    return p
+
+
+def main(argv=None, out=None):
+    options = parser().parse_args(argv)
+    if not options.directory:
+        parser().error('no ring directory given')
+    collector = Collector(options.directory, out or sys.stdout)
+    try:
+        if options.once:
+            collector.collect_once()
+        else:
+            collector.run(options.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,22 +4,27 @@ Functions for configuring the logging system in phlawg-friendly ways.
 
 from __future__ import absolute_import
 
-import json
+import logging
 import os
-from logging import config as logconf
-
-import six
+import threading
 
 import phlawg
+from phlawg import forksafe
 
 METRIC_HANDLER_KEY = 'phlawg_metrics_handler'
 METRIC_FORMATTER_KEY = 'phlawg_metrics_formatter'
 LOG_HANDLER_KEY = 'phlawg_default_handler'
 LOG_FORMATTER_KEY = 'phlawg_default_formatter'
+FLOOD_FILTER_KEY = 'phlawg_flood_filter'
 
 DEFAULT_METRIC_FIELDS = (
     'asctime', 'name', 'levelname', 'process', 'thread', 'message')
 
+# As DEFAULT_METRIC_FIELDS, but with the numeric epoch timestamp of the record
+# rather than a formatted date string, which avoids time formatting entirely.
+EPOCH_METRIC_FIELDS = (
+    'created', 'name', 'levelname', 'process', 'thread', 'message')
+
 def metric_logger_specification(name):
     return {"qualname": name,
             "level": "DEBUG",
@@ -28,7 +33,10 @@ def metric_logger_specification(name):
             }
 
 def metric_formatter_specification():
-    return {'()': 'pythonjsonlogger.jsonlogger.JsonFormatter',
+    # The JSON formatter is only built (and pythonjsonlogger only imported)
+    # once the first metric record is formatted.
+    return {'()': 'phlawg.lazy.LazyFormatter',
+            'factory': 'phlawg.formatter.MetricFormatter',
             'format': metric_field_format(DEFAULT_METRIC_FIELDS),
             }
 
@@ -39,6 +47,26 @@ def metric_handler_specification():
             'level': 'INFO',
             }
 
+def ring_handler_specification(directory):
+    return {'class': 'phlawg.ring.RingHandler',
+            'directory': directory,
+            'level': 'INFO',
+            }
+
+def prometheus_handler_specification(path, interval, port):
+    return {'class': 'phlawg.prometheus.PrometheusHandler',
+            'path': path,
+            'interval': interval,
+            'port': port,
+            'level': 'INFO',
+            }
+
+def flood_filter_specification(window, limit):
+    return {'()': 'phlawg.flood.FloodFilter',
+            'window': window,
+            'limit': limit,
+            }
+
 def metric_field_format(fields):
     return ' '.join('(%s)' % fld for fld in fields)
 
@@ -80,6 +108,11 @@ def env_var(variable, default=None, handler=lambda x: x):
     return default
 
 
+def json_loads(text):
+    import json
+    return json.loads(text)
+
+
 def env_flag(variable):
     return len(env_var(variable, default='')) > 0
 
@@ -94,6 +127,13 @@ class EnvConf(object):
     LOG_LEVEL_VAR = 'PHLAWG_LOG_LEVEL'
     FULL_CONF_VAR = 'PHLAWG_LOG_CONFIG'
     DISABLE_EXISTING_VAR = 'PHLAWG_DISABLE_EXISTING'
+    METRIC_FILTER_FILE_VAR = 'PHLAWG_METRIC_FILTER_FILE'
+    METRIC_RING_DIR_VAR = 'PHLAWG_METRIC_RING_DIR'
+    METRIC_TEXTFILE_VAR = 'PHLAWG_METRIC_TEXTFILE'
+    METRIC_TEXTFILE_INTERVAL_VAR = 'PHLAWG_METRIC_TEXTFILE_INTERVAL'
+    METRIC_EXPORT_PORT_VAR = 'PHLAWG_METRIC_EXPORT_PORT'
+    LOG_FLOOD_WINDOW_VAR = 'PHLAWG_LOG_FLOOD_WINDOW'
+    LOG_FLOOD_LIMIT_VAR = 'PHLAWG_LOG_FLOOD_LIMIT'
 
     def __init__(self, metric_packages=()):
         self.metric_packages = self.determine_metric_packages(*metric_packages)
@@ -104,6 +144,14 @@ class EnvConf(object):
         self.log_level = self.determine_log_level()
         self.metric_date_format = self.determine_metric_date_format()
         self.disable_existing = self.determine_disable_existing()
+        self.metric_filter_file = self.determine_metric_filter_file()
+        self.metric_ring_dir = self.determine_metric_ring_dir()
+        self.metric_textfile = self.determine_metric_textfile()
+        self.metric_textfile_interval = \
+                self.determine_metric_textfile_interval()
+        self.metric_export_port = self.determine_metric_export_port()
+        self.log_flood_window = self.determine_log_flood_window()
+        self.log_flood_limit = self.determine_log_flood_limit()
         self.specification = self.determine_specification()
 
 
@@ -117,7 +165,7 @@ class EnvConf(object):
 
     @classmethod
     def determine_specification(cls):
-        val = env_var(cls.FULL_CONF_VAR, default=None, handler=json.loads)
+        val = env_var(cls.FULL_CONF_VAR, default=None, handler=json_loads)
         if val:
             cls.ensure_metric_handler(val)
             cls.ensure_metric_formatter(val)
@@ -164,6 +212,35 @@ class EnvConf(object):
     def determine_disable_existing(cls):
         return env_flag(cls.DISABLE_EXISTING_VAR)
 
+    @classmethod
+    def determine_metric_filter_file(cls):
+        return env_var(cls.METRIC_FILTER_FILE_VAR)
+
+    @classmethod
+    def determine_metric_ring_dir(cls):
+        return env_var(cls.METRIC_RING_DIR_VAR)
+
+    @classmethod
+    def determine_metric_textfile(cls):
+        return env_var(cls.METRIC_TEXTFILE_VAR)
+
+    @classmethod
+    def determine_metric_textfile_interval(cls):
+        return env_var(cls.METRIC_TEXTFILE_INTERVAL_VAR, default=15.0,
+                       handler=float)
+
+    @classmethod
+    def determine_metric_export_port(cls):
+        return env_var(cls.METRIC_EXPORT_PORT_VAR, handler=int)
+
+    @classmethod
+    def determine_log_flood_window(cls):
+        return env_var(cls.LOG_FLOOD_WINDOW_VAR, handler=float)
+
+    @classmethod
+    def determine_log_flood_limit(cls):
+        return env_var(cls.LOG_FLOOD_LIMIT_VAR, default=1, handler=int)
+
     def apply_disable_existing(self, conf):
         if self.disable_existing:
             conf["disable_existing_loggers"] = 1
@@ -178,6 +255,19 @@ class EnvConf(object):
             conf["formatters"][METRIC_FORMATTER_KEY]['format'] = (
                     metric_field_format(self.metric_fields))
 
+    def apply_metric_ring_dir(self, conf):
+        if self.metric_ring_dir:
+            conf["handlers"][METRIC_HANDLER_KEY] = \
+                    ring_handler_specification(self.metric_ring_dir)
+
+    def apply_metric_export(self, conf):
+        if self.metric_textfile or self.metric_export_port is not None:
+            conf["handlers"][METRIC_HANDLER_KEY] = \
+                    prometheus_handler_specification(
+                            self.metric_textfile,
+                            self.metric_textfile_interval,
+                            self.metric_export_port)
+
     def apply_metric_level(self, conf):
         if self.metric_level:
             conf["handlers"][METRIC_HANDLER_KEY]['level'] = self.metric_level
@@ -186,6 +276,14 @@ class EnvConf(object):
         if self.log_level:
             conf["handlers"][LOG_HANDLER_KEY]['level'] = self.log_level
 
+    def apply_log_flood(self, conf):
+        if self.log_flood_window:
+            conf.setdefault("filters", {})[FLOOD_FILTER_KEY] = \
+                    flood_filter_specification(self.log_flood_window,
+                                               self.log_flood_limit)
+            conf["handlers"][LOG_HANDLER_KEY].setdefault(
+                    "filters", []).append(FLOOD_FILTER_KEY)
+
     def apply_log_format(self, conf):
         if self.log_format:
             conf["formatters"][LOG_FORMATTER_KEY]['format'] = self.log_format
@@ -208,8 +306,11 @@ class EnvConf(object):
         if not self.specification:
             self.apply_disable_existing(conf)
             self.apply_metric_fields(conf)
+            self.apply_metric_ring_dir(conf)
+            self.apply_metric_export(conf)
             self.apply_metric_level(conf)
             self.apply_log_level(conf)
+            self.apply_log_flood(conf)
             self.apply_log_format(conf)
             self.apply_log_date_format(conf)
             self.apply_metric_date_format(conf)
@@ -217,13 +318,99 @@ class EnvConf(object):
         return conf
 
 
+ENVIRONMENT_PREFIX = 'PHLAWG_'
+
+
+def environment_fingerprint():
+    """Returns a hashable snapshot of all ``PHLAWG_*`` environment variables."""
+    return tuple(sorted(
+        (name, value) for name, value in os.environ.items()
+        if name.startswith(ENVIRONMENT_PREFIX)))
+
+
+def configured_metric_handler(logger_names):
+    """Returns the "phlawg_metrics_handler" handler as attached to any of the
+    loggers named in `logger_names`, or ``None``."""
+    for name in logger_names:
+        for handler in logging.getLogger(name).handlers:
+            if handler.get_name() == METRIC_HANDLER_KEY:
+                return handler
+    return None
+
+
+class AppliedConfiguration(object):
+    """What the last full configuration by :func:`from_environment` was based on."""
+
+    def __init__(self, fingerprint, metric_packages, loggers):
+        self.fingerprint = fingerprint
+        self.metric_packages = set(metric_packages)
+        self.loggers = set(loggers)
+
+    def add_metric_loggers(self, metric_packages):
+        """Configures metric loggers for those of `metric_packages` not already
+        configured, without otherwise disturbing the logging configuration.
+
+        Returns ``False`` (having changed nothing) if this can't be done.
+        """
+        names = [name for name in EnvConf.determine_metric_packages(*metric_packages)
+                 if name not in self.loggers]
+        handler = configured_metric_handler(self.loggers)
+        if handler is None:
+            return False
+        for name in names:
+            logger = logging.getLogger(name)
+            logger.setLevel(logging.DEBUG)
+            logger.propagate = False
+            logger.disabled = False
+            for existing in list(logger.handlers):
+                logger.removeHandler(existing)
+            logger.addHandler(handler)
+        self.metric_packages.update(metric_packages)
+        self.loggers.update(names)
+        return True
+
+
+_applied = None
+_applied_lock = threading.Lock()
+_environment_metric_filter = None
+
+
+def apply_metric_filter_file(path):
+    """Installs a :class:`phlawg.metricfilter.MetricFilter` watching the rules
+    file at `path`, replacing one previously installed by this function.  With a
+    `path` of ``None``, just removes that previous one."""
+    global _environment_metric_filter
+    previous = _environment_metric_filter
+    if previous is not None:
+        previous.stop_watching()
+        if phlawg.get_metric_filter() is previous:
+            phlawg.set_metric_filter(None)
+        _environment_metric_filter = None
+    if path:
+        from phlawg import metricfilter
+        metric_filter = metricfilter.MetricFilter()
+        metric_filter.watch(path)
+        phlawg.set_metric_filter(metric_filter)
+        _environment_metric_filter = metric_filter
+
+
+def invalidate():
+    """Forgets the configuration applied by :func:`from_environment`, such that
+    the next call configures logging from scratch."""
+    global _applied
+    with _applied_lock:
+        _applied = None
+
+
 def from_environment(*metric_packages):
     """
     Configures python's logging system based on environment variables.
 
     Supported environment variables:
         ``PHLAWG_METRIC_FIELDS``: Comma-separated list of log record field names
-            to include in the JSON metric output.
+            to include in the JSON metric output.  Use "created" rather than
+            "asctime" for a numeric epoch timestamp, which is cheaper to produce
+            (see :data:`EPOCH_METRIC_FIELDS`).
 
         ``PHLAWG_METRIC_PACKAGES``: Python package/subpackage/module names under
             which metrics are expected to be logged.  Loggers with suitable
@@ -236,6 +423,24 @@ def from_environment(*metric_packages):
 
         ``PHLAWG_METRIC_LEVEL``: The logging level name to use for metric logs.
 
+        ``PHLAWG_METRIC_RING_DIR``: If set, metrics are not formatted and
+            written by this process, but written in binary form to a
+            shared-memory ring buffer file in this directory, for the
+            ``python -m phlawg.collector`` process to format and write; see
+            :mod:`phlawg.ring`.
+
+        ``PHLAWG_METRIC_TEXTFILE``: If set, metrics are not written to the log
+            stream; instead, the current state of each metric is written to
+            this file in the Prometheus text format every
+            ``PHLAWG_METRIC_TEXTFILE_INTERVAL`` seconds (default 15), atomically
+            replacing it.  Takes precedence over ``PHLAWG_METRIC_RING_DIR``; see
+            :mod:`phlawg.prometheus`.
+
+        ``PHLAWG_METRIC_EXPORT_PORT``: If set, metrics are not written to the
+            log stream; instead, the current state of each metric is served in
+            the Prometheus text format over HTTP on this local port.  May be
+            combined with ``PHLAWG_METRIC_TEXTFILE``.
+
         ``PHLAWG_LOG_FORMAT``: The log format string to use for regular log lines.
 
         ``PHLAWG_LOG_DATE_FORMAT``: The date formatting string to use for the
@@ -243,10 +448,20 @@ def from_environment(*metric_packages):
 
         ``PHLAWG_LOG_LEVEL``: The logging level name to use for regular logs.
 
+        ``PHLAWG_LOG_FLOOD_WINDOW``: If set, a number of seconds over which
+            repeated regular log messages are collapsed: per logger, level and
+            message template, only the first ``PHLAWG_LOG_FLOOD_LIMIT`` (default
+            1) records in each window are written, followed by a summary of
+            how many were suppressed; see :mod:`phlawg.flood`.
+
         ``PHLAWG_DISABLE_EXISTING``: If non-blank, existing loggers will be
             disabled.  If blank (the default), existing loggers are left
             enabled.
 
+        ``PHLAWG_METRIC_FILTER_FILE``: A rules file enabling and disabling
+            individual metrics or metric name prefixes, watched for changes at
+            runtime; see :mod:`phlawg.metricfilter`.
+
         ``PHLAWG_LOG_CONFIG``: a full log configuration dictionary as would be
             passed to :func:`logging.config.dictConfig`, encoded as JSON.  Note
             that this will be subject to some modification; the
@@ -263,14 +478,52 @@ def from_environment(*metric_packages):
     these will be merged, and all subject to :func:`phlawg.to_metric_logger_name`
     in determining the logger/qualname.
 
-    Metric loggers will use the :class:`pythonjsonlogger.jsonlogger.JsonFormatter`
-    formatter to express themselves as JSON dictionaries in the logstream.
+    Metric loggers will use the :class:`phlawg.formatter.MetricFormatter`
+    formatter (a :class:`pythonjsonlogger.jsonlogger.JsonFormatter`) to express
+    themselves as JSON dictionaries in the logstream.  It is built on first use,
+    via :class:`phlawg.lazy.LazyFormatter`.
 
     Logging levels are applied to the log handlers, not the loggers themselves.
 
     All logs will go to STDERR by default.
 
+    Where the platform supports it, fork hooks are installed (see
+    :mod:`phlawg.forksafe`) so that handlers are flushed before a fork and
+    per-process state is rebuilt in children.
+
+    Repeated calls are cheap, so that each library may call this at import.  The
+    ``PHLAWG_*`` environment is fingerprinted; when it is unchanged since the last
+    call, logging is not reconfigured, and only loggers for metric packages not
+    previously requested are added.  When the environment has changed, logging is
+    reconfigured from scratch, retaining the metric packages requested by earlier
+    calls.  If something else reconfigures logging in between, call
+    :func:`invalidate` so that the next call starts over.
+
     Returns ``True``.
     """
-    logconf.dictConfig(EnvConf(metric_packages).config)
+    global _applied
+    fingerprint = environment_fingerprint()
+    with _applied_lock:
+        applied = _applied
+        if applied is not None and applied.fingerprint == fingerprint:
+            if applied.metric_packages.issuperset(metric_packages):
+                return True
+            if applied.add_metric_loggers(metric_packages):
+                return True
+        if applied is not None:
+            metric_packages = tuple(sorted(applied.metric_packages)) + tuple(
+                name for name in metric_packages
+                if name not in applied.metric_packages)
+        from logging import config as logconf
+        env_conf = EnvConf(metric_packages)
+        conf = env_conf.config
+        logconf.dictConfig(conf)
+        if conf.get('filters'):
+            from phlawg import flood
+            flood.attach_configured_filters()
+        apply_metric_filter_file(env_conf.metric_filter_file)
+        _applied = AppliedConfiguration(
+            fingerprint, metric_packages, conf['loggers'])
+        phlawg.clear_metric_logger_cache()
+    forksafe.install()
     return True
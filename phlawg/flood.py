@@ -0,0 +1,203 @@
+"""
+Flood control for log streams.
+
+A :class:`FloodFilter` collapses repeated log messages: within each `window`
+seconds, only the first `limit` records with the same logger, level and message
+template (the unformatted message, so varying arguments still count as a
+repeat) are passed.  The rest are suppressed, and a summary saying how many
+times the message was repeated is logged once the window has passed (by a
+background thread, if nothing else comes along), or at exit.
+
+Summaries are logged only through the handler (or logger) the filter was
+attached to with :meth:`FloodFilter.attach`, since only its output had records
+suppressed.  A filter added any other way logs them through the logger of the
+suppressed records.
+
+:func:`phlawg.config.from_environment` applies a FloodFilter to the default
+(non-metric) handler when ``PHLAWG_LOG_FLOOD_WINDOW`` is set.
+"""
+
+from __future__ import absolute_import
+
+import atexit
+import logging
+import threading
+import time
+import weakref
+
+from phlawg import forksafe
+
+DEFAULT_WINDOW = 1.0
+DEFAULT_LIMIT = 1
+DEFAULT_MAX_KEYS = 10000
+
+SUMMARY_FORMAT = 'Previous message repeated %d times in %.1fs: %s'
+
+_filters = weakref.WeakSet()
+
+
+class FloodEntry(object):
+    """Tracks one message within its current window."""
+
+    __slots__ = ('started', 'passed', 'suppressed', 'last')
+
+    def __init__(self, started, record):
+        self.started = started
+        self.passed = 1
+        self.suppressed = 0
+        self.last = record
+
+
+class FloodFilter(logging.Filter):
+    """Passes at most `limit` records per logger, level and message template in
+    each `window` seconds, logging a summary of those suppressed.
+
+    At most `max_keys` distinct messages are tracked at once; beyond that,
+    pending summaries are logged early and tracking starts over.
+
+    While any records are suppressed, a background thread logs the summaries
+    of windows that have passed.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, limit=DEFAULT_LIMIT,
+                 max_keys=DEFAULT_MAX_KEYS, clock=time.time):
+        logging.Filter.__init__(self)
+        self.window = float(window)
+        self.limit = int(limit)
+        self.max_keys = max_keys
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.next_sweep = 0
+        self.target = None
+        self.sweeper = None
+        _filters.add(self)
+        forksafe.register(self)
+
+    def attach(self, filterer):
+        """Adds this filter to `filterer`, a handler or logger, through which
+        summaries are then logged."""
+        filterer.addFilter(self)
+        self.target = filterer
+
+    def filter(self, record):
+        if getattr(record, 'phlawg_flood_summary', False):
+            return True
+        try:
+            key = (record.name, record.levelno, record.msg)
+            hash(key)
+        except TypeError:
+            return True
+        now = self.clock()
+        sweeper = None
+        with self.lock:
+            summaries = []
+            if now >= self.next_sweep or len(self.entries) >= self.max_keys:
+                summaries = self.sweep(now)
+            entry = self.entries.get(key)
+            if entry is None or now - entry.started >= self.window:
+                if entry is not None and entry.suppressed:
+                    summaries.append(entry)
+                self.entries[key] = FloodEntry(now, record)
+                passed = True
+            elif entry.passed < self.limit:
+                entry.passed += 1
+                entry.last = record
+                passed = True
+            else:
+                entry.suppressed += 1
+                entry.last = record
+                passed = False
+                if self.sweeper is None:
+                    sweeper = self.sweeper = threading.Thread(
+                        target=self._sweep_periodically,
+                        name='phlawg-flood-sweeper')
+                    sweeper.daemon = True
+        if sweeper is not None:
+            sweeper.start()
+        # Outside the lock: logging a summary passes through this filter.
+        for entry in summaries:
+            self.log_summary(entry, now)
+        return passed
+
+    def _sweep_periodically(self):
+        while True:
+            time.sleep(self.window)
+            now = self.clock()
+            with self.lock:
+                summaries = self.sweep(now)
+                done = not any(entry.suppressed
+                               for entry in self.entries.values())
+                if done:
+                    self.sweeper = None
+            for entry in summaries:
+                self.log_summary(entry, now)
+            if done:
+                return
+
+    def sweep(self, now):
+        """Forgets expired entries (or all, if at capacity), returning those
+        with suppressed records.  Call with the lock held."""
+        self.next_sweep = now + self.window
+        force = len(self.entries) >= self.max_keys
+        summaries = []
+        for key, entry in list(self.entries.items()):
+            if force or now - entry.started >= self.window:
+                del self.entries[key]
+                if entry.suppressed:
+                    summaries.append(entry)
+        return summaries
+
+    def flush(self):
+        """Logs summaries for all suppressed records and starts over."""
+        now = self.clock()
+        with self.lock:
+            summaries = [entry for entry in self.entries.values()
+                         if entry.suppressed]
+            self.entries = {}
+        for entry in summaries:
+            self.log_summary(entry, now)
+
+    def summary_record(self, entry, now):
+        """Returns the log record summarizing the records suppressed for `entry`."""
+        last = entry.last
+        record = logging.LogRecord(
+            last.name, last.levelno, last.pathname, last.lineno,
+            SUMMARY_FORMAT,
+            (entry.suppressed, now - entry.started, last.getMessage()),
+            None, getattr(last, 'funcName', None))
+        record.phlawg_flood_summary = True
+        return record
+
+    def log_summary(self, entry, now):
+        record = self.summary_record(entry, now)
+        target = self.target
+        if target is None:
+            target = logging.getLogger(record.name)
+        target.handle(record)
+
+    def after_fork_in_child(self):
+        # The parent reports its own suppressed records; the sweeper thread
+        # does not survive the fork.
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.sweeper = None
+
+
+def attach_configured_filters():
+    """Makes each FloodFilter on a configured handler (as set up by
+    :func:`logging.config.dictConfig`) log its summaries through that handler."""
+    for handler in forksafe.configured_handlers():
+        for flood_filter in handler.filters:
+            if isinstance(flood_filter, FloodFilter):
+                flood_filter.target = handler
+
+
+@atexit.register
+def flush_all():
+    """Logs the pending summaries of all FloodFilters."""
+    for flood_filter in list(_filters):
+        try:
+            flood_filter.flush()
+        except Exception:
+            pass
@@ -0,0 +1,128 @@
+"""
+Fork-safety support for phlawg's logging state.
+
+Preforking servers commonly configure logging in a master process and then
+fork workers.  Anything phlawg creates that holds buffered output, background
+threads or per-process resources needs help to survive that: output buffered
+in the parent must be flushed before the fork (or each child will write its
+own copy of it), and threads do not exist in the child at all.
+
+This module installs a single set of :func:`os.register_at_fork` hooks (where
+the platform supports them) and dispatches to registered participants.  A
+participant is any object providing one or more of these methods:
+
+    ``before_fork()``: called in the parent just before forking.
+
+    ``after_fork_in_parent()``: called in the parent just after forking.
+
+    ``after_fork_in_child()``: called in the child just after forking; this
+        is the place to rebuild threads, buffers and per-process resources.
+
+Participants are held by weak reference, so registering an object does not
+keep it alive.
+
+Independent of participants, every handler attached to a configured logger
+is flushed before fork.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import weakref
+
+_participants = weakref.WeakSet()
+_lock = threading.Lock()
+_installed = False
+
+
+def supported():
+    """Returns ``True`` if the platform supports fork hooks."""
+    return hasattr(os, 'register_at_fork')
+
+
+def install():
+    """Installs phlawg's fork hooks, once per process.
+
+    Returns ``True`` if the hooks are (or already were) installed, ``False``
+    if the platform does not support them.
+    """
+    global _installed
+    if not supported():
+        return False
+    with _lock:
+        if not _installed:
+            os.register_at_fork(
+                    before=before_fork,
+                    after_in_parent=after_fork_in_parent,
+                    after_in_child=after_fork_in_child)
+            _installed = True
+    return True
+
+
+def register(participant):
+    """Registers `participant` for fork notifications and returns it."""
+    with _lock:
+        _participants.add(participant)
+    install()
+    return participant
+
+
+def unregister(participant):
+    """Stops delivering fork notifications to `participant`."""
+    with _lock:
+        _participants.discard(participant)
+
+
+def configured_handlers():
+    """Returns the distinct handlers attached to the root and named loggers."""
+    loggers = [logging.getLogger()]
+    loggers.extend(
+        logger for logger in list(logging.Logger.manager.loggerDict.values())
+        if isinstance(logger, logging.Logger))
+    handlers = []
+    for logger in loggers:
+        for handler in logger.handlers:
+            if handler not in handlers:
+                handlers.append(handler)
+    return handlers
+
+
+def flush_handlers():
+    """Flushes every configured handler, ignoring handlers that fail to flush."""
+    for handler in configured_handlers():
+        try:
+            handler.flush()
+        except Exception:
+            pass
+
+
+def _notify(method):
+    """Calls `method` of each participant providing it.  A participant's
+    failure is ignored, so that it cannot keep the others from running."""
+    with _lock:
+        participants = list(_participants)
+    for participant in participants:
+        callback = getattr(participant, method, None)
+        if callback is not None:
+            try:
+                callback()
+            except Exception:
+                pass
+
+
+def before_fork():
+    _notify('before_fork')
+    flush_handlers()
+
+
+def after_fork_in_parent():
+    _notify('after_fork_in_parent')
+
+
+def after_fork_in_child():
+    global _lock
+    # The lock may have been held by another thread at fork time.
+    _lock = threading.Lock()
+    _notify('after_fork_in_child')
@@ -0,0 +1,55 @@
+"""
+Deferred construction of logging components.
+
+Short-lived processes often configure logging but emit few or no metrics, so
+phlawg avoids paying for what it may never use at configuration time.
+"""
+
+from __future__ import absolute_import
+
+import importlib
+import logging
+import threading
+
+
+def resolve(name):
+    """Resolves a dotted `name` such as "package.module.Class" to the object."""
+    module_name, _, attribute = name.rpartition('.')
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+class LazyFormatter(logging.Formatter):
+    """A formatter that builds the formatter it delegates to on first use.
+
+    `factory` is the formatter class (or a dotted name resolving to it), and the
+    remaining keyword arguments are passed to it.  As with
+    :func:`logging.config.dictConfig`, "format" is accepted in place of "fmt".
+
+    Note that problems constructing the delegate (e.g. a missing dependency)
+    surface when the first record is formatted, not at configuration time.
+    """
+
+    def __init__(self, factory, **kwargs):
+        logging.Formatter.__init__(self)
+        if 'format' in kwargs:
+            kwargs['fmt'] = kwargs.pop('format')
+        self.factory = factory
+        self.kwargs = kwargs
+        self._delegate = None
+        self._lock = threading.Lock()
+
+    def delegate(self):
+        """Returns the delegate formatter, building it if necessary."""
+        delegate = self._delegate
+        if delegate is None:
+            with self._lock:
+                if self._delegate is None:
+                    factory = self.factory
+                    if not callable(factory):
+                        factory = resolve(factory)
+                    self._delegate = factory(**self.kwargs)
+                delegate = self._delegate
+        return delegate
+
+    def format(self, record):
+        return self.delegate().format(record)
@@ -0,0 +1,299 @@
+"""
+Synthetic metric load for stress testing a logging pipeline.
+
+Drives :class:`phlawg.MetricLogger` emission from any number of processes and
+threads, against whatever configuration :func:`phlawg.config.from_environment`
+builds from the current environment, and reports the achieved throughput,
+emission latency percentiles and sink lag:
+
+    PHLAWG_METRIC_LEVEL=INFO python -m phlawg.loadgen \\
+        --processes 4 --threads 8 --rate 500 --duration 60 --cardinality 200 myapp
+
+Emission latency is the time spent in the MetricLogger call.  Sink lag is the
+time from the creation of a log record to the point where the metric logger's
+handlers have all processed it, as observed by a probe handler attached after
+them.  The metric output goes wherever the configuration sends it (STDERR, by
+default); the report is written to STDOUT.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import logging
+import multiprocessing
+import random
+import sys
+import threading
+import time
+
+import phlawg
+from phlawg import arrays
+from phlawg import config
+
+REPORT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# Seconds between checks for failed worker processes while awaiting results.
+RESULT_POLL_INTERVAL = 0.5
+
+DISTRIBUTIONS = {
+    'constant': lambda rng: 1,
+    'uniform': lambda rng: rng.uniform(0, 1000),
+    'normal': lambda rng: rng.gauss(500, 100),
+    'exponential': lambda rng: rng.expovariate(1 / 100.0),
+    'integer': lambda rng: rng.randint(0, 1000),
+    }
+
+
+class Reservoir(object):
+    """Keeps a uniform random sample of at most `size` of the values added."""
+
+    def __init__(self, size, rng=None):
+        self.size = size
+        self.rng = rng or random.Random()
+        self.seen = 0
+        self.values = []
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            slot = self.rng.randrange(self.seen)
+            if slot < self.size:
+                self.values[slot] = value
+
+    def extend(self, values):
+        for value in values:
+            self.add(value)
+
+
+class LagProbe(logging.Handler):
+    """A handler that samples the time between record creation and handling."""
+
+    def __init__(self, sample_size, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.samples = Reservoir(sample_size)
+
+    def emit(self, record):
+        self.samples.add(time.time() - record.created)
+
+
+def metric_names(cardinality):
+    return ['loadgen_%d' % i for i in range(cardinality)]
+
+
+def generate(metric_logger, level, names, distribution, rate, count, deadline,
+             samples, seed=None):
+    """Emits metrics through `metric_logger` until `count` emissions have been
+    made or the `deadline` (per :func:`time.time`) has passed, at up to `rate`
+    emissions per second (unlimited if falsy).  Emission latencies are added to
+    the `samples` reservoir.  Returns the number of emissions made."""
+    rng = random.Random(seed)
+    draw = DISTRIBUTIONS[distribution]
+    interval = 1.0 / rate if rate else 0
+    cardinality = len(names)
+    timer = time.time
+    emit = metric_logger.log
+    emitted = 0
+    scheduled = timer()
+    while (not count or emitted < count) and (not deadline or timer() < deadline):
+        if interval:
+            scheduled += interval
+            delay = scheduled - timer()
+            if delay > 0:
+                time.sleep(delay)
+        metric = {names[rng.randrange(cardinality)]: draw(rng)}
+        started = timer()
+        emit(level, **metric)
+        samples.add(timer() - started)
+        emitted += 1
+    return emitted
+
+
+def run_process(options, results=None):
+    """Runs the load of one process: `options.threads` generator threads,
+    with a lag probe attached to the metric logger.  Returns (or puts into the
+    `results` queue, if given) a dict of the process's results."""
+    config.from_environment(options.package)
+    metric_logger = phlawg.get_metric_logger(options.package)
+    logger = metric_logger.logger
+    probe_level = min([handler.level for handler in logger.handlers] or
+                      [logging.NOTSET])
+    probe = LagProbe(options.samples, probe_level)
+    logger.addHandler(probe)
+
+    level = logging.getLevelName(options.level.upper())
+    names = metric_names(options.cardinality)
+    started = time.time()
+    deadline = started + options.duration if options.duration else None
+    reservoirs = [Reservoir(options.samples) for _ in range(options.threads)]
+    counts = [0] * options.threads
+    errors = []
+
+    def work(index):
+        try:
+            counts[index] = generate(
+                metric_logger, level, names, options.distribution,
+                options.rate, options.count, deadline, reservoirs[index])
+        except Exception as e:
+            errors.append('thread %d failed: %r' % (index, e))
+
+    threads = [threading.Thread(target=work, args=(index,))
+               for index in range(options.threads)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        logger.removeHandler(probe)
+    if errors:
+        raise WorkerError('; '.join(sorted(errors)))
+
+    latencies = Reservoir(options.samples)
+    for reservoir in reservoirs:
+        latencies.extend(reservoir.values)
+    result = {
+        'emitted': sum(counts),
+        'elapsed': time.time() - started,
+        'latency': latencies.values,
+        'lag': probe.samples.values,
+        }
+    if results is not None:
+        results.put(result)
+    return result
+
+
+class WorkerError(RuntimeError):
+    """Raised when worker threads or processes fail without reporting
+    results."""
+
+
+def collect_results(processes, results, poll_interval=RESULT_POLL_INTERVAL):
+    """Returns one result from the `results` queue per process in `processes`,
+    raising :class:`WorkerError` once it is clear that some processes have
+    failed (exited with a nonzero exit code) instead of reporting."""
+    from six.moves import queue
+    collected = []
+    failed = []
+    while len(collected) + len(failed) < len(processes):
+        try:
+            collected.append(results.get(timeout=poll_interval))
+        except queue.Empty:
+            failed = [process for process in processes
+                      if process.exitcode not in (None, 0)]
+    if failed:
+        raise WorkerError('%d of %d worker processes failed (exit codes: %s)' % (
+            len(failed), len(processes),
+            ', '.join(str(process.exitcode) for process in failed)))
+    return collected
+
+
+def run(options):
+    """Runs the load described by `options` across `options.processes`
+    processes, returning the combined results."""
+    if options.processes <= 1:
+        results = [run_process(options)]
+    else:
+        queue = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=run_process,
+                                             args=(options, queue))
+                     for _ in range(options.processes)]
+        for process in processes:
+            process.start()
+        try:
+            results = collect_results(processes, queue)
+        finally:
+            for process in processes:
+                process.join()
+    combined = {
+        'emitted': sum(result['emitted'] for result in results),
+        'elapsed': max(result['elapsed'] for result in results),
+        'latency': Reservoir(options.samples),
+        'lag': Reservoir(options.samples),
+        }
+    for result in results:
+        combined['latency'].extend(result['latency'])
+        combined['lag'].extend(result['lag'])
+    combined['latency'] = combined['latency'].values
+    combined['lag'] = combined['lag'].values
+    return combined
+
+
+def percentiles(seconds):
+    """Formats the report percentiles of a list of durations in `seconds`, in
+    microseconds."""
+    if not seconds:
+        return 'n/a'
+    ordered = sorted(seconds)
+    points = ['%s=%.1f' % (arrays.quantile_label(q),
+                           arrays.interpolated_quantile(ordered, q) * 1e6)
+              for q in REPORT_QUANTILES]
+    points.append('max=%.1f' % (ordered[-1] * 1e6))
+    return ' '.join(points)
+
+
+def report(options, result, out):
+    elapsed = result['elapsed']
+    rate = result['emitted'] / elapsed if elapsed else 0
+    print('emitted: %d metrics in %.3fs (%.1f/s) from %d process(es) x %d '
+          'thread(s)' % (result['emitted'], elapsed, rate, options.processes,
+                         options.threads), file=out)
+    print('emission latency (us): %s' % percentiles(result['latency']),
+          file=out)
+    print('sink lag (us): %s' % percentiles(result['lag']), file=out)
+
+
+def parser():
+    p = argparse.ArgumentParser(
+        prog='python -m phlawg.loadgen',
+        description='Generate synthetic metric load through phlawg.')
+    p.add_argument('package', nargs='?', default='loadgen',
+                   help='Package name whose metric logger is driven '
+                        '(default: %(default)s).')
+    p.add_argument('--processes', type=int, default=1,
+                   help='Number of processes (default: %(default)s).')
+    p.add_argument('--threads', type=int, default=1,
+                   help='Number of threads per process (default: %(default)s).')
+    p.add_argument('--rate', type=float, default=0,
+                   help='Emissions per second per thread; 0 for unlimited '
+                        '(default: %(default)s).')
+    p.add_argument('--duration', type=float, default=10,
+                   help='Seconds to run; 0 to rely on --count '
+                        '(default: %(default)s).')
+    p.add_argument('--count', type=int, default=0,
+                   help='Emissions per thread; 0 to rely on --duration '
+                        '(default: %(default)s).')
+    p.add_argument('--cardinality', type=int, default=10,
+                   help='Number of distinct metric names (default: %(default)s).')
+    p.add_argument('--distribution', choices=sorted(DISTRIBUTIONS),
+                   default='uniform',
+                   help='Distribution of metric values (default: %(default)s).')
+    p.add_argument('--level', default='INFO',
+                   help='Log level of emitted metrics (default: %(default)s).')
+    p.add_argument('--samples', type=int, default=10000,
+                   help='Latency samples kept per thread and for the report '
+                        '(default: %(default)s).')
+    return p
+
+
+def main(argv=None, out=None):
+    options = parser().parse_args(argv)
+    if not options.duration and not options.count:
+        parser().error('one of --duration or --count must be nonzero')
+    if not isinstance(logging.getLevelName(options.level.upper()), int):
+        parser().error('unknown log level: %s' % options.level)
+    for name in ('processes', 'threads', 'cardinality'):
+        if getattr(options, name) < 1:
+            parser().error('--%s must be at least 1' % name)
+    try:
+        result = run(options)
+    except WorkerError as e:
+        print('loadgen: %s' % e, file=sys.stderr)
+        return 1
+    report(options, result, out or sys.stdout)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
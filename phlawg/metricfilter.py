@@ -0,0 +1,239 @@
+"""
+Runtime enabling and disabling of individual metrics.
+
+A :class:`MetricFilter` holds rules enabling or disabling metrics by full name
+("<metric logger name>.<metric>", e.g. "myapp.metrics.db.query_ms") or by any
+dotted prefix of it ("myapp.metrics.db", "myapp.metrics").  The rule for the
+longest matching prefix wins, and metrics no rule matches are enabled.
+
+Once installed with :func:`phlawg.set_metric_filter`, every
+:class:`phlawg.MetricLogger` consults the filter before formatting anything.
+Decisions are kept in a lookup table keyed by logger name and metric, so in
+the steady state the check costs a single dict lookup; changing the rules
+discards the table.
+
+Rules may be changed at runtime through the API (:meth:`MetricFilter.enable`,
+:meth:`MetricFilter.disable`, :meth:`MetricFilter.set_rules`), by loading a
+rules file, by watching a rules file for changes (:meth:`MetricFilter.watch`)
+or by reloading a rules file upon a signal (:meth:`MetricFilter.reload_on_signal`).
+A rules file has one name per line; a name prefixed with "+" is enabled, and one
+prefixed with "-" (or with no prefix) is disabled.  Blank lines and "#" comments
+are ignored.  A missing rules file means no rules.
+
+:func:`phlawg.config.from_environment` watches the file named by the
+``PHLAWG_METRIC_FILTER_FILE`` environment variable, if set.
+
+A MetricFilter is also a :class:`logging.Filter`, passing records that do not
+carry a disabled metric, so it may be attached to handlers as well.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+
+from phlawg import forksafe
+
+DEFAULT_WATCH_INTERVAL = 5.0
+
+# Bounds the decision table for metric names of unbounded cardinality.
+TABLE_LIMIT = 10000
+
+
+def parse_rules(lines):
+    """Parses rules file `lines` into a dict of name to enabled flag."""
+    rules = {}
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if line[0] == '+':
+            rules[line[1:].strip()] = True
+        elif line[0] == '-':
+            rules[line[1:].strip()] = False
+        else:
+            rules[line] = False
+    return rules
+
+
+def file_signature(path):
+    """Returns something that changes when the file at `path` does."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+class MetricFilter(logging.Filter):
+    """Enables and disables metrics by name or name prefix; see :mod:`phlawg.metricfilter`."""
+
+    def __init__(self, rules=None):
+        logging.Filter.__init__(self)
+        self.lock = threading.Lock()
+        self.rules = dict(rules or {})
+        self.table = {}
+        self.watched_path = None
+        self.watched_signature = None
+        self.watch_interval = DEFAULT_WATCH_INTERVAL
+        self.watcher = None
+        self.stop_event = None
+        self.reload_path = None
+        self.reloader = None
+        self.reload_event = None
+
+    def set_rules(self, rules):
+        """Replaces all rules with `rules`, a dict of name to enabled flag."""
+        with self.lock:
+            # Rules before table: a decision made concurrently under the old
+            # rules can then only land in the discarded table.
+            self.rules = dict(rules)
+            self.table = {}
+
+    def update(self, name, enabled):
+        """Sets the rule for `name` to `enabled`."""
+        with self.lock:
+            rules = dict(self.rules)
+            rules[name] = enabled
+            self.rules = rules
+            self.table = {}
+
+    def enable(self, name):
+        """Enables the metric or metric name prefix `name`."""
+        self.update(name, True)
+
+    def disable(self, name):
+        """Disables the metric or metric name prefix `name`."""
+        self.update(name, False)
+
+    def clear(self):
+        """Removes all rules, enabling everything."""
+        self.set_rules({})
+
+    def decide(self, full_name):
+        """Returns whether the metric with full name `full_name` is enabled,
+        per the rule for its longest matching prefix."""
+        rules = self.rules
+        name = full_name
+        while True:
+            enabled = rules.get(name)
+            if enabled is not None:
+                return enabled
+            idx = name.rfind('.')
+            if idx == -1:
+                return True
+            name = name[:idx]
+
+    def allows(self, logger_name, metric):
+        """Returns whether `metric` of the logger named `logger_name` is enabled."""
+        key = (logger_name, metric)
+        table = self.table
+        enabled = table.get(key)
+        if enabled is None:
+            enabled = self.decide('%s.%s' % key)
+            if len(table) >= TABLE_LIMIT:
+                table.clear()
+            table[key] = enabled
+        return enabled
+
+    def filter(self, record):
+        metric = getattr(record, 'metric', None)
+        if metric is None:
+            return True
+        return self.allows(record.name, metric)
+
+    def load(self, path):
+        """Replaces all rules with those of the rules file at `path`."""
+        try:
+            with open(path) as rules_file:
+                rules = parse_rules(rules_file)
+        except (IOError, OSError):
+            rules = {}
+        self.set_rules(rules)
+
+    def watch(self, path, interval=DEFAULT_WATCH_INTERVAL):
+        """Loads the rules file at `path`, and reloads it from a background
+        thread whenever it changes, checking every `interval` seconds."""
+        self.stop_watching()
+        self.watched_path = path
+        self.watch_interval = interval
+        self.watched_signature = file_signature(path)
+        self.load(path)
+        self.start_watcher()
+        forksafe.register(self)
+
+    def check(self, path=None):
+        """Reloads the watched rules file (or the one at `path`) if it has
+        changed."""
+        if path is None:
+            path = self.watched_path
+            if path is None:
+                return
+        signature = file_signature(path)
+        if signature != self.watched_signature:
+            self.watched_signature = signature
+            self.load(path)
+
+    def start_watcher(self):
+        stop_event = self.stop_event = threading.Event()
+        self.watcher = threading.Thread(
+            target=self._watch, args=(stop_event, self.watched_path),
+            name='phlawg-metric-filter-watcher')
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def _watch(self, stop_event, path):
+        # The path is fixed for the thread's life; stop_watching may clear
+        # watched_path at any moment.
+        while not stop_event.wait(self.watch_interval):
+            self.check(path)
+
+    def stop_watching(self):
+        """Stops watching the rules file, if watching."""
+        if self.watcher is not None:
+            self.stop_event.set()
+            self.watcher = None
+            self.watched_path = None
+            if self.reloader is None:
+                forksafe.unregister(self)
+
+    def after_fork_in_child(self):
+        # Neither the watcher nor the reloader thread survives the fork.
+        if self.watcher is not None:
+            self.start_watcher()
+        if self.reloader is not None:
+            self.start_reloader()
+
+    def reload_on_signal(self, path, signum=None):
+        """Loads the rules file at `path`, and reloads it whenever the process
+        receives signal `signum` (SIGHUP by default).  Must be called from the
+        main thread.
+
+        The signal handler only wakes a background thread, which does the
+        reloading; loading in the handler itself could deadlock on the lock
+        of a rule change the signal interrupted."""
+        import signal
+        if signum is None:
+            signum = signal.SIGHUP
+        self.load(path)
+        self.reload_path = path
+        if self.reloader is None:
+            self.start_reloader()
+            forksafe.register(self)
+        signal.signal(signum, lambda signum, frame: self.reload_event.set())
+
+    def start_reloader(self):
+        reload_event = self.reload_event = threading.Event()
+        self.reloader = threading.Thread(
+            target=self._reload, args=(reload_event,),
+            name='phlawg-metric-filter-reloader')
+        self.reloader.daemon = True
+        self.reloader.start()
+
+    def _reload(self, reload_event):
+        while True:
+            reload_event.wait()
+            # Cleared first, so a signal arriving during the load is not lost.
+            reload_event.clear()
+            self.load(self.reload_path)
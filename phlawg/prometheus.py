@@ -0,0 +1,288 @@
+"""
+Pull-based export of metric state in the Prometheus text format.
+
+Rather than writing every metric value into the log stream, a
+:class:`PrometheusHandler` keeps the current state of each metric in memory,
+and periodically writes a snapshot of it to a file, atomically replacing the
+previous one, for the node exporter's textfile collector (or any other scraper)
+to pick up.  It can also serve the snapshot over HTTP on a local port.  Either
+way, the I/O cost is constant regardless of how often metrics are logged.
+
+:func:`phlawg.config.from_environment` uses a PrometheusHandler as the metric
+handler when ``PHLAWG_METRIC_TEXTFILE`` or ``PHLAWG_METRIC_EXPORT_PORT`` is set.
+
+Every metric is exported in the same three metric families, identified by
+"logger" and "metric" labels (so that, for instance, the "hits" metric of the
+"myapp.metrics.cache" logger is ``{logger="myapp.metrics.cache",metric="hits"}``
+and never collides with another):
+
+    ``phlawg_metric_last``: the last value logged, as a gauge.
+
+    ``phlawg_metric_sum``: the sum of all values logged, as a gauge (it
+        decreases when negative values are logged).
+
+    ``phlawg_metric_count_total``: the number of values logged, as a counter.
+
+Only numeric metric values are exported; other records are ignored.
+
+In a forked child, the state inherited from the parent is discarded.  The
+child writes its own snapshot only if the textfile path contains ``{pid}``,
+which is replaced with the process id (and exported as a "pid" label, so that
+series from several processes can be told apart); it does not serve HTTP.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import math
+import os
+import tempfile
+import threading
+
+import phlawg
+from phlawg import forksafe
+
+DEFAULT_INTERVAL = 15.0
+DEFAULT_HOST = '127.0.0.1'
+PID_PLACEHOLDER = '{pid}'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Name, type, help and index into the (last, sum, count) state of each family.
+FAMILIES = (
+    ('phlawg_metric_last', 'gauge', 'Last value logged for the metric.', 0),
+    ('phlawg_metric_sum', 'gauge', 'Sum of the values logged for the metric.', 1),
+    ('phlawg_metric_count_total', 'counter',
+     'Number of values logged for the metric.', 2),
+    )
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def escape_label_value(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    """Returns the text format label set for `labels`, a sequence of
+    ``(name, value)`` pairs."""
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, escape_label_value(value)) for name, value in labels)
+
+
+def format_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class MetricState(object):
+    """The last value, sum and count of the values logged for a metric."""
+
+    __slots__ = ('last', 'sum', 'count')
+
+    def __init__(self):
+        self.last = 0.0
+        self.sum = 0.0
+        self.count = 0
+
+    def update(self, value):
+        self.last = value
+        self.sum += value
+        self.count += 1
+
+    def update_summary(self, mean, summary):
+        """Folds in the values summarized by `summary` (see
+        :func:`phlawg.arrays.summarize`), taking their `mean` as the last."""
+        self.last = mean
+        self.sum += float(summary['sum'])
+        self.count += int(summary['count'])
+
+
+def render(series, labels=()):
+    """Returns the text format exposition of `series`, a sequence of
+    ``((logger name, metric), (last, sum, count))`` pairs, with the additional
+    `labels` (``(name, value)`` pairs, for instance ``[('pid', '12')]``)
+    applied to each sample."""
+    series = sorted(series)
+    label_sets = [format_labels([('logger', logger_name), ('metric', metric)]
+                                + list(labels))
+                  for (logger_name, metric), _ in series]
+    lines = []
+    for name, family_type, help_text, index in FAMILIES:
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, family_type))
+        for label_set, (_, state) in zip(label_sets, series):
+            lines.append('%s%s %s' % (name, label_set, format_value(state[index])))
+    return ''.join(line + '\n' for line in lines)
+
+
+def write_atomically(path, text):
+    """Writes `text` to a temporary file in the directory of `path`, then
+    renames it to `path`, so that readers never see a partial file."""
+    directory, basename = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(prefix='.' + basename + '.',
+                                     dir=directory or '.')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(text.encode('utf-8'))
+        _replace(temp_path, path)
+    except Exception:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def http_server(host, port, handler):
+    """Returns an HTTP server on (`host`, `port`) serving the exposition text
+    returned by `handler`."""
+    try:
+        from http import server
+    except ImportError:
+        import BaseHTTPServer as server
+
+    class RequestHandler(server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = handler.exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return server.HTTPServer((host, port), RequestHandler)
+
+
+class PrometheusHandler(logging.Handler):
+    """A handler keeping the state of the metrics it handles, and exporting it
+    in the Prometheus text format.
+
+    If `path` is given, the state is written there every `interval` seconds,
+    and when the handler is closed.  If `port` is given, the state is served
+    over HTTP on (`host`, `port`); port 0 picks a free port, available as
+    :attr:`port` afterwards.
+    """
+
+    def __init__(self, path=None, interval=DEFAULT_INTERVAL, port=None,
+                 host=DEFAULT_HOST, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.path_template = path
+        self.interval = interval
+        self.host = host
+        self.port = port
+        self.series = {}
+        self.pid = os.getpid()
+        self.writer = None
+        self.server = None
+        if path is not None:
+            self.start_writer()
+        if port is not None:
+            self.start_server()
+        forksafe.register(self)
+
+    @property
+    def path(self):
+        if self.path_template is None:
+            return None
+        return self.path_template.replace(PID_PLACEHOLDER, str(self.pid))
+
+    @property
+    def labels(self):
+        if self.path_template and PID_PLACEHOLDER in self.path_template:
+            return [('pid', str(self.pid))]
+        return []
+
+    def emit(self, record):
+        # Called with the handler lock held.
+        try:
+            for metric, value, summary in phlawg.record_metrics(record):
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                key = (record.name, metric)
+                state = self.series.get(key)
+                if state is None:
+                    state = self.series[key] = MetricState()
+                if summary is None:
+                    state.update(value)
+                else:
+                    state.update_summary(value, summary)
+        except Exception:
+            self.handleError(record)
+
+    def snapshot(self):
+        """Returns a list of ``((logger name, metric), (last, sum, count))``
+        pairs for the metrics handled so far."""
+        self.acquire()
+        try:
+            return [(key, (state.last, state.sum, state.count))
+                    for key, state in self.series.items()]
+        finally:
+            self.release()
+
+    def exposition(self):
+        """Returns the current state in the Prometheus text format."""
+        return render(self.snapshot(), self.labels)
+
+    def write(self):
+        """Writes the current state to the textfile."""
+        write_atomically(self.path, self.exposition())
+
+    def start_writer(self):
+        stop_event = self.stop_event = threading.Event()
+        self.writer = threading.Thread(
+            target=self._write_periodically, args=(stop_event,),
+            name='phlawg-prometheus-writer')
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _write_periodically(self, stop_event):
+        while not stop_event.wait(self.interval):
+            try:
+                self.write()
+            except Exception:
+                # Keep exporting; the next interval may succeed.
+                pass
+
+    def start_server(self):
+        self.server = http_server(self.host, self.port, self)
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  name='phlawg-prometheus-server')
+        thread.daemon = True
+        thread.start()
+
+    def after_fork_in_child(self):
+        # The parent's state, threads and listening socket stay with the parent.
+        self.series = {}
+        self.pid = os.getpid()
+        if self.server is not None:
+            self.server.socket.close()
+            self.server = None
+        if self.writer is not None:
+            if PID_PLACEHOLDER in self.path_template:
+                self.start_writer()
+            else:
+                self.writer = None
+
+    def close(self):
+        if self.writer is not None:
+            self.stop_event.set()
+            self.writer = None
+            try:
+                self.write()
+            except Exception:
+                pass
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        forksafe.unregister(self)
+        logging.Handler.close(self)
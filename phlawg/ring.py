@@ -0,0 +1,346 @@
+"""
+Shared-memory ring buffer transport for metrics.
+
+With this transport, application processes do no metric formatting or I/O.
+Each process writes fixed-size binary metric records into a memory-mapped ring
+buffer file of its own, and a separate collector process
+(``python -m phlawg.collector``, see :mod:`phlawg.collector`) drains the rings
+of all processes, formats the records as JSON and writes the stream.
+
+:func:`phlawg.config.from_environment` uses a :class:`RingHandler` as the metric
+handler when ``PHLAWG_METRIC_RING_DIR`` names a directory for the ring files.
+
+Each ring file ("<pid>-<serial>.ring", a new one for each writer) has a
+64-byte header followed by `capacity` 32-byte records, each holding a
+timestamp, an interned metric name id, the log level, the value and the thread
+id.  Metric names are interned per ring: the logger name and metric for each
+id are appended to a companion names file ("<pid>-<serial>.ring.names") before
+the id is first used.  A ring file is created and initialized under a
+temporary name, then renamed into place, so the collector never sees a
+partial one, and no ring is ever reused: a process reconfiguring its logging
+gets a new ring, and the collector drains and removes the old one once its
+writer has closed it.
+
+A ring has a single writer (its process, serialized by a lock) and a single
+reader (the collector), each owning one of the header's two counters.  When
+the ring is full, new records are dropped rather than blocking the application,
+and counted in the header.
+
+Only integer, boolean and floating point metric values can be carried, and
+they keep their type (integers outside the 64-bit range become floats); other
+records are ignored.
+"""
+
+from __future__ import absolute_import
+
+import io
+import itertools
+import logging
+import mmap
+import numbers
+import os
+import struct
+import tempfile
+import threading
+
+import phlawg
+from phlawg import forksafe
+
+MAGIC = b'PHLAWGR2'
+DEFAULT_CAPACITY = 65536
+RING_SUFFIX = '.ring'
+NAMES_SUFFIX = '.names'
+
+# magic, record size, capacity, pid, written, read, dropped, closed
+HEADER = struct.Struct('<8sIIQQQQQ')
+HEADER_SIZE = 64
+WRITTEN_OFFSET = 24
+READ_OFFSET = 32
+DROPPED_OFFSET = 40
+CLOSED_OFFSET = 48
+COUNTER = struct.Struct('<Q')
+
+# Value kinds, and the record layout for each: created, name id, level number,
+# value kind, value, thread.
+FLOAT = 0
+INTEGER = 1
+BOOLEAN = 2
+RECORDS = {
+    FLOAT: struct.Struct('<dIHBxdQ'),
+    INTEGER: struct.Struct('<dIHBxqQ'),
+    BOOLEAN: struct.Struct('<dIHBxqQ'),
+    }
+RECORD_SIZE = 32
+KIND = struct.Struct('<B')
+KIND_OFFSET = 14
+INTEGER_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+_serials = itertools.count()
+
+
+def ring_path(directory, pid, serial=0):
+    return os.path.join(directory, '%d-%d%s' % (pid, serial, RING_SUFFIX))
+
+
+def new_ring_path(directory):
+    """Returns a path for a new ring of this process in `directory`."""
+    while True:
+        path = ring_path(directory, os.getpid(), next(_serials))
+        if not os.path.exists(path):
+            return path
+
+
+def value_kind(value):
+    """Returns the kind of `value` and the value to store for it, or ``None``
+    if it cannot be carried."""
+    if isinstance(value, bool):
+        return BOOLEAN, int(value)
+    if isinstance(value, numbers.Integral):
+        value = int(value)
+        if INTEGER_RANGE[0] <= value <= INTEGER_RANGE[1]:
+            return INTEGER, value
+        return FLOAT, float(value)
+    if isinstance(value, numbers.Real):
+        return FLOAT, float(value)
+    return None
+
+
+class RingWriter(object):
+    """Writes metric records into a new ring file at `path`."""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, pid=None):
+        self.path = path
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.names = {}
+        self.written = 0
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        directory, basename = os.path.split(path)
+        fd, temp_path = tempfile.mkstemp(prefix='.' + basename + '.',
+                                         dir=directory or '.')
+        try:
+            with os.fdopen(fd, 'w+b') as ring_file:
+                ring_file.truncate(size)
+                self.map = mmap.mmap(ring_file.fileno(), size)
+            HEADER.pack_into(self.map, 0, MAGIC, RECORD_SIZE, capacity,
+                             os.getpid() if pid is None else pid, 0, 0, 0, 0)
+            self.names_file = io.open(path + NAMES_SUFFIX, 'w', encoding='utf-8')
+            # Only a complete ring is visible to the collector.
+            os.rename(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    def intern(self, logger_name, metric):
+        """Returns the id of the name pair, recording it if new.  Call with
+        the lock held."""
+        key = (logger_name, metric)
+        name_id = self.names.get(key)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names_file.write(u'%d\t%s\t%s\n' % (name_id, logger_name, metric))
+            self.names_file.flush()
+            self.names[key] = name_id
+        return name_id
+
+    def write(self, created, logger_name, metric, levelno, value, thread=0):
+        """Writes a record, returning ``False`` if the ring is full and the
+        record was dropped.  `value` must be an integer, boolean or float."""
+        kind, value = value_kind(value)
+        with self.lock:
+            written = self.written
+            read = COUNTER.unpack_from(self.map, READ_OFFSET)[0]
+            if written - read >= self.capacity:
+                dropped = COUNTER.unpack_from(self.map, DROPPED_OFFSET)[0]
+                COUNTER.pack_into(self.map, DROPPED_OFFSET, dropped + 1)
+                return False
+            name_id = self.intern(logger_name, metric)
+            RECORDS[kind].pack_into(
+                self.map, HEADER_SIZE + (written % self.capacity) * RECORD_SIZE,
+                created, name_id, levelno, kind, value, thread)
+            # Publish the record only once it is complete.
+            self.written = written + 1
+            COUNTER.pack_into(self.map, WRITTEN_OFFSET, self.written)
+        return True
+
+    def close(self):
+        """Closes the ring, marking it as such for the collector to remove it
+        once drained."""
+        with self.lock:
+            COUNTER.pack_into(self.map, CLOSED_OFFSET, 1)
+            self.map.close()
+            self.names_file.close()
+
+
+class RingRecord(object):
+    """A metric record read from a ring."""
+
+    __slots__ = ('created', 'name', 'metric', 'levelno', 'value', 'process',
+                 'thread')
+
+    def __init__(self, created, name, metric, levelno, value, process, thread):
+        self.created = created
+        self.name = name
+        self.metric = metric
+        self.levelno = levelno
+        self.value = value
+        self.process = process
+        self.thread = thread
+
+    def as_tuple(self):
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+
+class RingReader(object):
+    """Reads metric records from the ring file at `path`."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'r+b') as ring_file:
+            self.map = mmap.mmap(ring_file.fileno(), 0)
+        magic, record_size, self.capacity, self.pid, _, _, _, _ = \
+                HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            self.map.close()
+            raise ValueError('not a phlawg ring file: %s' % path)
+        self.names = {}
+
+    def load_names(self):
+        with io.open(self.path + NAMES_SUFFIX, encoding='utf-8') as names_file:
+            for line in names_file:
+                if not line.endswith(u'\n'):
+                    break
+                name_id, logger_name, metric = line[:-1].split(u'\t', 2)
+                self.names[int(name_id)] = (logger_name, metric)
+
+    def name(self, name_id):
+        names = self.names.get(name_id)
+        if names is None:
+            self.load_names()
+            names = self.names[name_id]
+        return names
+
+    def pending(self):
+        """Returns the number of records waiting to be read."""
+        return (COUNTER.unpack_from(self.map, WRITTEN_OFFSET)[0] -
+                COUNTER.unpack_from(self.map, READ_OFFSET)[0])
+
+    def dropped(self):
+        """Returns the number of records dropped because the ring was full."""
+        return COUNTER.unpack_from(self.map, DROPPED_OFFSET)[0]
+
+    def closed(self):
+        """Returns ``True`` if the writer has closed the ring."""
+        return COUNTER.unpack_from(self.map, CLOSED_OFFSET)[0] != 0
+
+    def drain(self, limit=None):
+        """Reads and returns a list of the pending :class:`RingRecord`\\s, up to
+        `limit` of them, releasing their space in the ring."""
+        written = COUNTER.unpack_from(self.map, WRITTEN_OFFSET)[0]
+        read = COUNTER.unpack_from(self.map, READ_OFFSET)[0]
+        if limit is not None:
+            written = min(written, read + limit)
+        records = []
+        for index in range(read, written):
+            offset = HEADER_SIZE + (index % self.capacity) * RECORD_SIZE
+            kind = KIND.unpack_from(self.map, offset + KIND_OFFSET)[0]
+            created, name_id, levelno, _, value, thread = \
+                    RECORDS[kind].unpack_from(self.map, offset)
+            if kind == BOOLEAN:
+                value = bool(value)
+            logger_name, metric = self.name(name_id)
+            records.append(RingRecord(created, logger_name, metric, levelno,
+                                      value, self.pid, thread))
+        COUNTER.pack_into(self.map, READ_OFFSET, written)
+        return records
+
+    def close(self):
+        self.map.close()
+
+    def remove(self):
+        """Closes the reader and deletes the ring and its names file."""
+        self.close()
+        for path in (self.path, self.path + NAMES_SUFFIX):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+class RingHandler(logging.Handler):
+    """A handler writing metric records into this process's ring in `directory`.
+
+    The ring is created on the first metric record, so processes forked before
+    then get rings of their own; a process forked after gets a new one as well.
+    Metric values other than integers, booleans and floats are ignored.
+
+    `directory` is created if it does not exist.  If the ring cannot be
+    created nonetheless, the error is reported once, and records are then
+    dropped.
+    """
+
+    def __init__(self, directory, capacity=DEFAULT_CAPACITY, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+        self.directory = directory
+        self.capacity = capacity
+        self.writer = None
+        self.failed = False
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created concurrently by another process, or failing; then
+                # creating the ring reports it.
+                pass
+        forksafe.register(self)
+
+    def ring_writer(self):
+        """Returns the ring writer, creating it if need be, or ``None`` if the
+        ring could not be created."""
+        writer = self.writer
+        if writer is None:
+            self.acquire()
+            try:
+                if self.writer is None and not self.failed:
+                    try:
+                        self.writer = RingWriter(
+                            new_ring_path(self.directory), self.capacity)
+                    except Exception:
+                        self.failed = True
+                        raise
+                writer = self.writer
+            finally:
+                self.release()
+        return writer
+
+    def emit(self, record):
+        try:
+            metrics = phlawg.record_metrics(record)
+            if not metrics:
+                return
+            writer = self.ring_writer()
+            if writer is None:
+                return
+            for metric, value, _ in metrics:
+                if value_kind(value) is None:
+                    continue
+                writer.write(record.created, record.name, metric,
+                             record.levelno, value, record.thread or 0)
+        except Exception:
+            self.handleError(record)
+
+    def after_fork_in_child(self):
+        # The inherited ring belongs to the parent; this process needs its own.
+        self.writer = None
+        self.failed = False
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+        finally:
+            self.release()
+        forksafe.unregister(self)
+        logging.Handler.close(self)
@@ -0,0 +1,154 @@
+"""
+Request-scoped accumulation of metrics.
+
+Within a :class:`MetricScope`, metrics emitted through any
+:class:`phlawg.MetricLogger` are captured rather than logged.  When the scope
+exits, the captured metrics are emitted as one consolidated log record per
+metric logger and level, optionally carrying the scope's tags.  So a request
+handler that would otherwise emit dozens of metric lines emits one:
+
+    with phlawg.MetricScope(endpoint='/users'):
+        handle_request()
+
+    @phlawg.MetricScope(job='reindex')
+    def reindex():
+        ...
+
+The active scope is tracked with :mod:`contextvars`, so scopes in concurrent
+threads or asyncio tasks do not see each other's metrics.  On Pythons without
+:mod:`contextvars`, scopes are tracked per thread.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import functools
+import threading
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+class _ThreadLocalVar(object):
+    """Minimal stand-in for :class:`contextvars.ContextVar` using thread-locals."""
+
+    def __init__(self, name):
+        self.name = name
+        self.local = threading.local()
+
+    def get(self, default=None):
+        return getattr(self.local, 'value', default)
+
+    def set(self, value):
+        token = self.get()
+        self.local.value = value
+        return token
+
+    def reset(self, token):
+        self.local.value = token
+
+
+if contextvars is not None:
+    _current = contextvars.ContextVar('phlawg_metric_scope', default=None)
+else:
+    _current = _ThreadLocalVar('phlawg_metric_scope')
+
+
+def current():
+    """Returns the active :class:`MetricScope`, or ``None``."""
+    return _current.get(None)
+
+
+class MetricScope(object):
+    """Captures metrics emitted within a unit of work and emits them together.
+
+    Use an instance as a context manager, or as a decorator, in which case each
+    call of the decorated function gets a scope of its own.  Likewise, each
+    entry into a ``with`` statement starts a scope of its own (the ``as``
+    target), so one instance may be reused, even by concurrent threads or tasks.
+    Keyword arguments are tags describing the unit of work, and are included in
+    each consolidated record.
+
+    Only metrics the metric logger deems emittable (see
+    :meth:`phlawg.MetricLogger.emittable`) are captured.  A metric emitted more
+    than once through the same metric logger and level within a scope is
+    accumulated with :meth:`phlawg.MetricLogger.accumulate`.
+
+    Scopes nest; metrics are captured by the innermost active scope only.
+
+    Work started within a scope that outlives it (an asyncio task, or a
+    function run in a copy of the context) still sees the scope as active; once
+    the scope has exited, its metrics are emitted directly rather than captured.
+    """
+
+    def __init__(self, **tags):
+        self.tags = tags
+        self.captured = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.closed = False
+        # Set on the scope started by entering another.
+        self.owner = None
+        self.token = None
+
+    def capture(self, metric_logger, emitter, args, metrics):
+        """Captures `metrics` for later emission by calling `emitter` of
+        `metric_logger` with the positional `args` plus the message.
+
+        Returns ``False``, capturing nothing, if the scope has exited; the
+        caller should then emit the metrics itself."""
+        key = (metric_logger, emitter, args)
+        with self.lock:
+            if self.closed:
+                return False
+            accumulated = self.captured.get(key)
+            if accumulated is None:
+                accumulated = self.captured[key] = collections.OrderedDict()
+            for name, value in metrics.items():
+                if not metric_logger.emittable(name, value):
+                    continue
+                if name in accumulated:
+                    value = metric_logger.accumulate(accumulated[name], value)
+                accumulated[name] = value
+        return True
+
+    def emit(self):
+        """Emits and forgets everything captured so far."""
+        with self.lock:
+            captured, self.captured = self.captured, collections.OrderedDict()
+        for (metric_logger, emitter, args), metrics in captured.items():
+            if not metrics:
+                continue
+            msg, xtra = metric_logger.consolidated_message_and_extra(
+                    metrics, self.tags)
+            emitter(*(args + (msg,)), extra=xtra)
+
+    def __enter__(self):
+        entry = type(self)(**self.tags)
+        entry.owner = self
+        entry.token = _current.set(entry)
+        return entry
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Each context (task or thread) has its own current scope, which is the
+        # one entered here, provided scopes are exited in order.
+        entry = _current.get(None)
+        if entry is None or entry.owner is not self:
+            raise RuntimeError('MetricScope exited out of order')
+        _current.reset(entry.token)
+        entry.close()
+        return False
+
+    def close(self):
+        """Emits everything captured, and stops capturing."""
+        with self.lock:
+            self.closed = True
+        self.emit()
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def scoped(*args, **kwargs):
+            with self:
+                return fn(*args, **kwargs)
+        return scoped
@@ -0,0 +1,93 @@
+import logging
+
+from nose import tools
+from nose.plugins.skip import SkipTest
+from six import moves
+
+import phlawg
+from phlawg import allocation
+from phlawg import config
+from phlawg import formatter
+from phlawg import lazy
+
+
+def setup():
+    if allocation.tracemalloc is None:
+        raise SkipTest('tracemalloc unavailable')
+
+
+def metric_logger():
+    logger = logging.getLogger('allocation.metrics.test')
+    logger.propagate = False
+    return phlawg.MetricLogger(logger)
+
+
+def test_measure():
+    report = allocation.measure(lambda: bytearray(1000), iterations=100)
+    # What the function returns is kept, and so counted.
+    tools.assert_true(1000 <= report.bytes < 1200, report)
+    # The bytearray object and its buffer.
+    tools.assert_true(2 <= report.blocks < 2.2, report)
+    tools.assert_true(report.peak_bytes >= 1000, report)
+
+
+def test_measure_excludes_temporaries():
+    report = allocation.measure(lambda: bytearray(1000) and None, iterations=100)
+    tools.assert_true(report.bytes < 10, report)
+    tools.assert_true(report.peak_bytes >= 1000, report)
+
+
+def test_budget_exceeded():
+    tools.assert_raises(
+        AssertionError, allocation.assert_allocation_budget,
+        lambda: bytearray(1000), bytes=500)
+
+
+def test_profile_stages():
+    reports = allocation.profile(
+        metric_logger(), {'a': 1, 'b': 2.5},
+        formatter.MetricFormatter('(message)'), iterations=10)
+    tools.assert_equal(
+        list(allocation.STAGES), [report.stage for report in reports])
+
+
+def test_configured_formatter():
+    logger = logging.Logger('allocation.metrics.formatter')
+    tools.assert_equal(None, allocation.configured_formatter(logger))
+    handler = logging.StreamHandler(moves.StringIO())
+    # Lazily built formatters are unwrapped.
+    handler.setFormatter(lazy.LazyFormatter(
+        'phlawg.formatter.MetricFormatter', format='(message)'))
+    logger.addHandler(handler)
+    tools.assert_true(isinstance(allocation.configured_formatter(logger),
+                                 formatter.MetricFormatter))
+
+
+# Per-emission allocation budgets for the hot path.  Exact counts vary with
+# the interpreter version, so each budget leaves room for that variation,
+# while staying below what one more object kept per call would add.
+
+def stage(name):
+    fmt = formatter.MetricFormatter(
+        config.metric_field_format(config.DEFAULT_METRIC_FIELDS))
+    return allocation.stage_functions(
+        metric_logger(), {'metric_a': 1.5}, fmt)[name]
+
+
+def test_message_and_extra_budget():
+    # The message string, the extra dict and its values, and the yielded
+    # tuple (which may come from a free list): about 4 blocks.
+    allocation.assert_allocation_budget(
+        stage('message_and_extra'), blocks=5.5, bytes=800)
+
+
+def test_level_emit_budget():
+    # Nothing outlives the emission.
+    allocation.assert_allocation_budget(
+        stage('_level_emit'), blocks=0.5, peak_bytes=4096)
+
+
+def test_formatter_budget():
+    # Only the formatted output survives.
+    allocation.assert_allocation_budget(
+        stage('formatter'), blocks=1.5, peak_bytes=8192)
@@ -0,0 +1,96 @@
+from nose import tools
+from nose.plugins.skip import SkipTest
+import mock
+
+import phlawg
+from phlawg import arrays
+
+
+def numpy_or_skip():
+    try:
+        import numpy
+    except ImportError:
+        raise SkipTest('numpy unavailable')
+    return numpy
+
+
+class TestSummarize(object):
+    def test_sequence(self):
+        summary = arrays.summarize([4, 1, 3, 2, 5], quantiles=(0.5, 0.9))
+        tools.assert_equal(
+            {'count': 5, 'sum': 15, 'min': 1, 'max': 5, 'mean': 3.0,
+             'p50': 3, 'p90': 4.6},
+            dict(summary, p90=round(summary['p90'], 6)))
+
+    def test_empty(self):
+        tools.assert_equal(None, arrays.summarize([]))
+
+    def test_single(self):
+        tools.assert_equal(
+            {'count': 1, 'sum': 2.5, 'min': 2.5, 'max': 2.5, 'mean': 2.5,
+             'p50': 2.5, 'p90': 2.5, 'p99': 2.5},
+            arrays.summarize([2.5]))
+
+    def test_quantile_labels(self):
+        tools.assert_equal(
+            ['p0', 'p50', 'p99', 'p99.9', 'p100'],
+            [arrays.quantile_label(q) for q in (0, 0.5, 0.99, 0.999, 1)])
+
+    def test_numpy_matches_sequence(self):
+        numpy = numpy_or_skip()
+        values = [0.25 * i for i in range(1001)]
+        expect = arrays.summarize(values)
+        actual = arrays.summarize(numpy.array(values))
+        tools.assert_equal(sorted(expect), sorted(actual))
+        for key in expect:
+            tools.assert_almost_equal(expect[key], actual[key])
+
+    def test_numpy_empty(self):
+        numpy = numpy_or_skip()
+        tools.assert_equal(None, arrays.summarize(numpy.array([])))
+
+
+class TestLogArray(object):
+    def setup(self):
+        self.base_logger = mock.Mock(name='BaseLogger')
+        self.logger = phlawg.MetricLogger(self.base_logger)
+        self.level = mock.Mock(name='LogLevel')
+
+    def test_summary(self):
+        self.logger.log_array(self.level, 'loss', [1, 2, 3], quantiles=(0.5,))
+        summary = {'count': 3, 'sum': 6, 'min': 1, 'max': 3, 'mean': 2.0,
+                   'p50': 2}
+        self.base_logger.log.assert_called_once_with(
+            self.level, 'loss=count:3 max:3 mean:2.0 min:1 p50:2 sum:6',
+            extra={'metric': 'loss', 'value': 2.0, 'summary': summary})
+
+    def test_summary_empty(self):
+        self.logger.log_array(self.level, 'loss', [])
+        tools.assert_equal([], self.base_logger.log.call_args_list)
+
+    def test_individual(self):
+        self.logger.log_array(self.level, 'loss', (0.5, 0.25), summarize=False)
+        tools.assert_equal(
+            [mock.call(self.level, 'loss=0.5',
+                       extra={'metric': 'loss', 'value': 0.5}),
+             mock.call(self.level, 'loss=0.25',
+                       extra={'metric': 'loss', 'value': 0.25})],
+            self.base_logger.log.call_args_list)
+
+    def test_individual_numpy(self):
+        numpy = numpy_or_skip()
+        self.logger.log_array(
+            self.level, 'loss', numpy.array([[0.5], [0.25]]), summarize=False)
+        tools.assert_equal(
+            [mock.call(self.level, 'loss=0.5',
+                       extra={'metric': 'loss', 'value': 0.5}),
+             mock.call(self.level, 'loss=0.25',
+                       extra={'metric': 'loss', 'value': 0.25})],
+            self.base_logger.log.call_args_list)
+
+    def test_disabled_level(self):
+        self.base_logger.isEnabledFor.return_value = False
+        self.logger.log_array(self.level, 'loss', [1, 2, 3])
+        self.logger.log_array(self.level, 'loss', [1, 2, 3], summarize=False)
+        self.base_logger.isEnabledFor.assert_called_with(self.level)
+        tools.assert_equal([], self.base_logger.log.call_args_list)
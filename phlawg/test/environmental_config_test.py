@@ -1,6 +1,7 @@
 import logging
 import os
 import json
+import tempfile
 from nose import tools
 import mock
 import six
@@ -17,10 +18,20 @@ METRIC_DATE_FORMAT_VAR = 'PHLAWG_METRIC_DATE_FORMAT'
 LOG_LEVEL_VAR = 'PHLAWG_LOG_LEVEL'
 METRIC_LEVEL_VAR = 'PHLAWG_METRIC_LEVEL'
 DISABLE_EXISTING_VAR = 'PHLAWG_DISABLE_EXISTING'
+METRIC_FILTER_FILE_VAR = 'PHLAWG_METRIC_FILTER_FILE'
+METRIC_RING_DIR_VAR = 'PHLAWG_METRIC_RING_DIR'
+METRIC_TEXTFILE_VAR = 'PHLAWG_METRIC_TEXTFILE'
+METRIC_TEXTFILE_INTERVAL_VAR = 'PHLAWG_METRIC_TEXTFILE_INTERVAL'
+METRIC_EXPORT_PORT_VAR = 'PHLAWG_METRIC_EXPORT_PORT'
+LOG_FLOOD_WINDOW_VAR = 'PHLAWG_LOG_FLOOD_WINDOW'
+LOG_FLOOD_LIMIT_VAR = 'PHLAWG_LOG_FLOOD_LIMIT'
 
 ALL_VARS = [
         FULL_CONF_VAR, LOG_FORMAT_VAR, DATE_FORMAT_VAR,
-        METRIC_FIELDS_VAR, METRIC_PACKAGES_VAR, DISABLE_EXISTING_VAR]
+        METRIC_FIELDS_VAR, METRIC_PACKAGES_VAR, DISABLE_EXISTING_VAR,
+        METRIC_FILTER_FILE_VAR, METRIC_RING_DIR_VAR, METRIC_TEXTFILE_VAR,
+        METRIC_TEXTFILE_INTERVAL_VAR, METRIC_EXPORT_PORT_VAR,
+        LOG_FLOOD_WINDOW_VAR, LOG_FLOOD_LIMIT_VAR]
 
 DEFAULT_FORMAT = '%(asctime)s %(levelname)s #%(process)d %(thread)d %(name)s ' \
         '%(message)s'
@@ -61,7 +72,8 @@ def default_formatter_spec(format=DEFAULT_FORMAT, datefmt=None, **kw):
 
 def metric_formatter_spec(format=METRIC_FORMAT, **kw):
     if '()' not in kw:
-        kw['()'] = 'pythonjsonlogger.jsonlogger.JsonFormatter'
+        kw['()'] = 'phlawg.lazy.LazyFormatter'
+        kw['factory'] = 'phlawg.formatter.MetricFormatter'
     return default_formatter_spec(**dict(kw, format=format))
 
 def default_config():
@@ -91,6 +103,7 @@ def mocks(fn):
                 for var in ALL_VARS:
                     if var in os.environ:
                         del os.environ[var]
+                config.invalidate()
                 return fn(*(a + (os.environ, dictconf)), **kw)
     return wrapped
 
@@ -414,6 +427,7 @@ def try_log_levels(log_level, metric_level,
         os.environ[LOG_LEVEL_VAR] = log_level
     if metric_level:
         os.environ[METRIC_LEVEL_VAR] = metric_level
+    config.invalidate()
     config.from_environment('spaz')
     metric = phlawg.MetricLogger(logging.getLogger(phlawg.to_metric_logger_name('spaz')))
     try_log(exp_log_warn, logging.warn, 'hello')
@@ -446,3 +460,171 @@ def test_log_levels():
     ]
     for log_l, met_l, explw, expli, expld, expmw, expmi, expmd in tests:
         yield try_log_levels, log_l, met_l, explw, expli, expld, expmw, expmi, expmd
+
+
+@mocks
+def test_memoized_same_environment(env, logconf):
+    config.from_environment()
+    config.from_environment()
+    comparable_call(logconf, default_config())
+
+
+@mocks
+def test_memoized_known_packages(env, logconf):
+    config.from_environment('topguy', 'second.guy')
+    config.from_environment('second.guy')
+    config.from_environment()
+    expect = default_config()
+    add_metric_loggers(expect, 'topguy.metrics', 'second.metrics.guy')
+    del expect['loggers']['metrics']
+    comparable_call(logconf, expect)
+
+
+@mocks
+def test_reconfigure_on_environment_change(env, logconf):
+    config.from_environment('topguy')
+    env[LOG_LEVEL_VAR] = 'WARN'
+    config.from_environment('second.guy')
+    tools.assert_equal(2, logconf.call_count)
+    # Packages requested before are retained.
+    expect = default_config()
+    expect["handlers"]["phlawg_default_handler"]["level"] = 'WARN'
+    add_metric_loggers(expect, 'topguy.metrics', 'second.metrics.guy')
+    del expect['loggers']['metrics']
+    tools.assert_equal(expect, logconf.call_args_list[1][0][0])
+
+
+@mocks
+def test_invalidate(env, logconf):
+    config.from_environment()
+    config.invalidate()
+    config.from_environment()
+    tools.assert_equal(2, logconf.call_count)
+
+
+@mocks
+def test_new_packages_without_metric_handler(env, logconf):
+    # With dictConfig mocked out, there's no metric handler to attach
+    # to new loggers, so it falls back to full reconfiguration.
+    config.from_environment('topguy')
+    config.from_environment('second.guy')
+    tools.assert_equal(2, logconf.call_count)
+    expect = default_config()
+    add_metric_loggers(expect, 'topguy.metrics', 'second.metrics.guy')
+    del expect['loggers']['metrics']
+    tools.assert_equal(expect, logconf.call_args_list[1][0][0])
+
+
+@mock.patch.dict(os.environ)
+def test_incremental_metric_loggers():
+    for var in ALL_VARS:
+        if var in os.environ:
+            del os.environ[var]
+    config.invalidate()
+    config.from_environment('memoone')
+    handler = config.configured_metric_handler(['memoone.metrics'])
+    tools.assert_true(handler is not None)
+    stale = logging.StreamHandler()
+    logging.getLogger('memotwo.metrics').addHandler(stale)
+    with mock.patch('logging.config.dictConfig') as logconf:
+        config.from_environment('memotwo')
+    tools.assert_equal(0, logconf.call_count)
+    logger = logging.getLogger('memotwo.metrics')
+    tools.assert_equal([handler], logger.handlers)
+    tools.assert_equal(logging.DEBUG, logger.level)
+    tools.assert_false(logger.propagate)
+    # The original metric logger is undisturbed.
+    tools.assert_equal(
+        [handler], logging.getLogger('memoone.metrics').handlers)
+
+
+@mocks
+def test_metric_filter_file_var(env, logconf):
+    rules = tempfile.NamedTemporaryFile(mode='w', suffix='.rules', delete=False)
+    try:
+        rules.write('app.metrics.noisy\n')
+        rules.close()
+        env[METRIC_FILTER_FILE_VAR] = rules.name
+        config.from_environment()
+        # The configuration itself is unaffected.
+        comparable_call(logconf, default_config())
+        installed = phlawg.get_metric_filter()
+        tools.assert_equal(rules.name, installed.watched_path)
+        tools.assert_false(installed.allows('app.metrics', 'noisy'))
+        # Removing the variable removes the filter on reconfiguration.
+        del env[METRIC_FILTER_FILE_VAR]
+        config.from_environment()
+        tools.assert_equal(None, phlawg.get_metric_filter())
+        tools.assert_equal(None, installed.watcher)
+    finally:
+        config.apply_metric_filter_file(None)
+        os.unlink(rules.name)
+
+
+@mocks
+def test_metric_ring_dir_var(env, logconf):
+    env[METRIC_RING_DIR_VAR] = '/some/ring/dir'
+    env[METRIC_LEVEL_VAR] = 'DEBUG'
+    config.from_environment()
+    expect = default_config()
+    expect['handlers']['phlawg_metrics_handler'] = {
+        'class': 'phlawg.ring.RingHandler',
+        'directory': '/some/ring/dir',
+        'level': 'DEBUG',
+        }
+    comparable_call(logconf, expect)
+
+
+@mocks
+def test_log_flood_vars(env, logconf):
+    env[LOG_FLOOD_LIMIT_VAR] = '5'
+    config.from_environment()
+    # No window, no filter.
+    comparable_call(logconf, default_config())
+
+    logconf.reset_mock()
+    env[LOG_FLOOD_WINDOW_VAR] = '2.5'
+    config.from_environment()
+    expect = default_config()
+    expect['filters'] = {
+        'phlawg_flood_filter': {
+            '()': 'phlawg.flood.FloodFilter',
+            'window': 2.5,
+            'limit': 5,
+            },
+        }
+    expect['handlers']['phlawg_default_handler']['filters'] = [
+        'phlawg_flood_filter']
+    comparable_call(logconf, expect)
+
+
+@mocks
+def test_metric_textfile_vars(env, logconf):
+    env[METRIC_TEXTFILE_VAR] = '/some/dir/app.prom'
+    env[METRIC_TEXTFILE_INTERVAL_VAR] = '30'
+    env[METRIC_RING_DIR_VAR] = '/some/ring/dir'
+    config.from_environment()
+    expect = default_config()
+    expect['handlers']['phlawg_metrics_handler'] = {
+        'class': 'phlawg.prometheus.PrometheusHandler',
+        'path': '/some/dir/app.prom',
+        'interval': 30.0,
+        'port': None,
+        'level': 'INFO',
+        }
+    comparable_call(logconf, expect)
+
+
+@mocks
+def test_metric_export_port_var(env, logconf):
+    env[METRIC_EXPORT_PORT_VAR] = '9101'
+    config.from_environment()
+    expect = default_config()
+    expect['handlers']['phlawg_metrics_handler'] = {
+        'class': 'phlawg.prometheus.PrometheusHandler',
+        'path': None,
+        'interval': 15.0,
+        'port': 9101,
+        'level': 'INFO',
+        }
+    comparable_call(logconf, expect)
@@ -0,0 +1,170 @@
+import logging
+import time
+
+from nose import tools
+import mock
+
+from phlawg import flood
+
+
+class Clock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestFloodFilter(object):
+    def setup(self):
+        self.clock = Clock()
+        self.filter = flood.FloodFilter(window=10, limit=2, clock=self.clock)
+        self.logged = []
+        self.log_summary = mock.patch.object(
+            self.filter, 'log_summary',
+            side_effect=lambda entry, now: self.logged.append(
+                self.filter.summary_record(entry, now)))
+        self.log_summary.start()
+
+    def teardown(self):
+        self.log_summary.stop()
+        self.filter.entries = {}
+
+    def record(self, msg='disk %s is full', args=('sda',), name='app',
+               level=logging.WARNING):
+        return logging.LogRecord(name, level, __file__, 10, msg, args, None)
+
+    def passes(self, *records):
+        return [self.filter.filter(record) for record in records]
+
+    def test_limit_per_window(self):
+        tools.assert_equal(
+            [True, True, False, False],
+            self.passes(*[self.record(args=(str(i),)) for i in range(4)]))
+        tools.assert_equal([], self.logged)
+        self.clock.now += 10
+        tools.assert_equal([True], self.passes(self.record(args=('sdz',))))
+        summary, = self.logged
+        tools.assert_equal(
+            'Previous message repeated 2 times in 10.0s: disk 3 is full',
+            summary.getMessage())
+        tools.assert_equal(('app', logging.WARNING),
+                           (summary.name, summary.levelno))
+        tools.assert_true(self.filter.filter(summary))
+
+    def test_distinct_keys(self):
+        tools.assert_equal(
+            [True, True, True, True],
+            self.passes(self.record(), self.record(name='other'),
+                        self.record(level=logging.ERROR),
+                        self.record(msg='another %s')))
+
+    def test_no_summary_without_suppression(self):
+        self.passes(self.record(), self.record())
+        self.clock.now += 10
+        self.passes(self.record())
+        tools.assert_equal([], self.logged)
+
+    def test_expired_entries_swept(self):
+        self.passes(*[self.record() for i in range(3)])
+        self.clock.now += 11
+        self.passes(self.record(name='other'))
+        tools.assert_equal(1, len(self.logged))
+        tools.assert_equal(['other'], [k[0] for k in self.filter.entries])
+
+    def test_max_keys(self):
+        self.filter.max_keys = 3
+        self.passes(*[self.record() for i in range(3)])
+        for i in range(10):
+            self.filter.filter(self.record(msg='message %d' % i))
+            tools.assert_true(len(self.filter.entries) <= 3)
+        tools.assert_equal(1, len(self.logged))
+
+    def test_flush(self):
+        self.passes(*[self.record() for i in range(5)])
+        self.filter.flush()
+        tools.assert_equal(
+            ['Previous message repeated 3 times in 0.0s: disk sda is full'],
+            [summary.getMessage() for summary in self.logged])
+        tools.assert_equal({}, self.filter.entries)
+
+    def test_flush_all(self):
+        self.passes(*[self.record() for i in range(3)])
+        flood.flush_all()
+        tools.assert_equal(1, len(self.logged))
+
+    def test_after_fork_in_child(self):
+        self.passes(*[self.record() for i in range(3)])
+        self.filter.after_fork_in_child()
+        tools.assert_equal({}, self.filter.entries)
+        tools.assert_equal(None, self.filter.sweeper)
+
+    def test_unhashable_message(self):
+        tools.assert_equal(
+            [True, True],
+            self.passes(*[self.record(msg={'a': 1}, args=()) for i in range(2)]))
+
+
+def mock_handler():
+    handler = logging.Handler()
+    handler.emit = mock.Mock()
+    return handler
+
+
+def emitted(handler):
+    return [c[0][0].getMessage() for c in handler.emit.call_args_list]
+
+
+def test_handler_filter():
+    logger = logging.getLogger('phlawg.test.flood')
+    handler = mock_handler()
+    other = mock_handler()
+    clock = Clock()
+    flood.FloodFilter(window=1, clock=clock).attach(handler)
+    logger.addHandler(handler)
+    logger.addHandler(other)
+    logger.propagate = False
+    try:
+        for i in range(100):
+            logger.warning('retrying %d', i)
+        clock.now += 1
+        logger.warning('retrying %d', 100)
+    finally:
+        logger.removeHandler(handler)
+        logger.removeHandler(other)
+        logger.propagate = True
+    tools.assert_equal(
+        ['retrying 0',
+         'Previous message repeated 99 times in 1.0s: retrying 99',
+         'retrying 100'],
+        emitted(handler))
+    # The summary only goes where records were suppressed.
+    tools.assert_equal(['retrying %d' % i for i in range(101)], emitted(other))
+
+
+def test_summary_after_storm():
+    handler = mock_handler()
+    flood.FloodFilter(window=0.05).attach(handler)
+    record = logging.LogRecord('app', logging.WARNING, __file__, 10,
+                               'retrying', (), None)
+    for i in range(3):
+        handler.handle(record)
+    deadline = time.time() + 5
+    while len(emitted(handler)) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    tools.assert_equal(
+        ['retrying', 'Previous message repeated 2 times'],
+        [message.split(' in ')[0] for message in emitted(handler)])
+
+
+def test_attach_configured_filters():
+    handler = mock_handler()
+    flood_filter = flood.FloodFilter()
+    handler.addFilter(flood_filter)
+    logger = logging.getLogger('phlawg.test.flood')
+    logger.addHandler(handler)
+    try:
+        flood.attach_configured_filters()
+    finally:
+        logger.removeHandler(handler)
+    tools.assert_true(flood_filter.target is handler)
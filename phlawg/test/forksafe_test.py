@@ -0,0 +1,120 @@
+import logging
+import os
+
+from nose import tools
+from nose.plugins.skip import SkipTest
+import mock
+
+from phlawg import forksafe
+
+
+class Participant(object):
+    def __init__(self):
+        self.calls = []
+
+    def before_fork(self):
+        self.calls.append('before_fork')
+
+    def after_fork_in_parent(self):
+        self.calls.append('after_fork_in_parent')
+
+    def after_fork_in_child(self):
+        self.calls.append('after_fork_in_child')
+
+
+class PartialParticipant(object):
+    def __init__(self):
+        self.calls = []
+
+    def after_fork_in_child(self):
+        self.calls.append('after_fork_in_child')
+
+
+class TestForkSafe(object):
+    def setup(self):
+        self.participant = forksafe.register(Participant())
+        self.partial = forksafe.register(PartialParticipant())
+
+    def teardown(self):
+        forksafe.unregister(self.participant)
+        forksafe.unregister(self.partial)
+
+    def test_dispatch(self):
+        forksafe.before_fork()
+        forksafe.after_fork_in_parent()
+        forksafe.after_fork_in_child()
+        tools.assert_equal(
+            ['before_fork', 'after_fork_in_parent', 'after_fork_in_child'],
+            self.participant.calls)
+        # Participants need only implement the hooks they care about.
+        tools.assert_equal(['after_fork_in_child'], self.partial.calls)
+
+    def test_failing_participant(self):
+        failing = mock.Mock(name='FailingParticipant')
+        failing.before_fork.side_effect = RuntimeError('broken')
+        failing.after_fork_in_child.side_effect = RuntimeError('broken')
+        forksafe.register(failing)
+        handler = mock.Mock(name='Handler')
+        logger = logging.getLogger('phlawg.test.forksafe')
+        logger.addHandler(handler)
+        try:
+            forksafe.before_fork()
+            forksafe.after_fork_in_child()
+        finally:
+            logger.removeHandler(handler)
+            forksafe.unregister(failing)
+        # Everyone else was still notified, and handlers still flushed.
+        tools.assert_equal(['before_fork', 'after_fork_in_child'],
+                           self.participant.calls)
+        tools.assert_equal(['after_fork_in_child'], self.partial.calls)
+        handler.flush.assert_called_once_with()
+
+    def test_unregister(self):
+        forksafe.unregister(self.participant)
+        forksafe.after_fork_in_child()
+        tools.assert_equal([], self.participant.calls)
+
+    def test_weak_registration(self):
+        participant = forksafe.register(Participant())
+        count = len(forksafe._participants)
+        del participant
+        tools.assert_equal(count - 1, len(forksafe._participants))
+
+    def test_flush_before_fork(self):
+        handler = mock.Mock(name='Handler')
+        logger = logging.getLogger('phlawg.test.forksafe')
+        logger.addHandler(handler)
+        try:
+            forksafe.before_fork()
+        finally:
+            logger.removeHandler(handler)
+        handler.flush.assert_called_once_with()
+
+    def test_flush_failure_ignored(self):
+        handler = mock.Mock(name='Handler')
+        handler.flush.side_effect = IOError('closed')
+        logger = logging.getLogger('phlawg.test.forksafe')
+        logger.addHandler(handler)
+        try:
+            forksafe.flush_handlers()
+        finally:
+            logger.removeHandler(handler)
+        handler.flush.assert_called_once_with()
+
+    def test_real_fork(self):
+        if not (forksafe.supported() and hasattr(os, 'fork')):
+            raise SkipTest('fork hooks unsupported')
+        forksafe.install()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, ','.join(self.participant.calls).encode('ascii'))
+            os._exit(0)
+        os.close(write_fd)
+        child_calls = os.read(read_fd, 1024).decode('ascii')
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+        tools.assert_equal('before_fork,after_fork_in_child', child_calls)
+        tools.assert_equal(
+            ['before_fork', 'after_fork_in_parent'], self.participant.calls)
@@ -0,0 +1,67 @@
+import json
+import logging
+
+from nose import tools
+import mock
+
+from phlawg import config
+from phlawg import formatter
+
+
+def record(created, msg='metric_a=1'):
+    rec = logging.makeLogRecord({
+        'name': 'app.metrics', 'levelno': logging.INFO, 'levelname': 'INFO',
+        'msg': msg, 'metric': 'metric_a', 'value': 1})
+    rec.created = created
+    rec.msecs = (created - int(created)) * 1000
+    return rec
+
+
+class TestMetricFormatter(object):
+    def setup(self):
+        self.formatter = formatter.MetricFormatter(
+            config.metric_field_format(config.DEFAULT_METRIC_FIELDS))
+        self.reference = logging.Formatter()
+
+    def test_matches_standard_time_format(self):
+        for created in (1464720821.955, 1464720821.0, 1464720822.5,
+                        1464720821.999):
+            rec = record(created)
+            tools.assert_equal(
+                self.reference.formatTime(rec),
+                self.formatter.formatTime(rec))
+
+    def test_matches_standard_with_datefmt(self):
+        rec = record(1464720821.955)
+        tools.assert_equal(
+            self.reference.formatTime(rec, '%H:%M:%S'),
+            self.formatter.formatTime(rec, '%H:%M:%S'))
+        # Switching formats invalidates the cached prefix.
+        tools.assert_equal(
+            self.reference.formatTime(rec),
+            self.formatter.formatTime(rec))
+
+    def test_renders_once_per_second(self):
+        with mock.patch('time.strftime', wraps=formatter.time.strftime) as strf:
+            for i in range(10):
+                self.formatter.formatTime(record(1464720821 + i / 10.0))
+            self.formatter.formatTime(record(1464720822.1))
+        tools.assert_equal(2, strf.call_count)
+
+    def test_json_output(self):
+        out = json.loads(self.formatter.format(record(1464720821.955)))
+        tools.assert_equal(
+            ['asctime', 'levelname', 'message', 'metric', 'name', 'process',
+             'thread', 'value'],
+            sorted(out.keys()))
+        tools.assert_equal(
+            self.reference.formatTime(record(1464720821.955)), out['asctime'])
+
+    def test_epoch_fields(self):
+        epoch = formatter.MetricFormatter(
+            config.metric_field_format(config.EPOCH_METRIC_FIELDS))
+        with mock.patch('time.strftime') as strf:
+            out = json.loads(epoch.format(record(1464720821.955)))
+        tools.assert_equal(0, strf.call_count)
+        tools.assert_equal(1464720821.955, out['created'])
+        tools.assert_false('asctime' in out)
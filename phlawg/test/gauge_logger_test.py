@@ -0,0 +1,146 @@
+import logging
+import os
+
+from nose import tools
+import mock
+from six import moves
+
+import phlawg
+from phlawg import config
+
+
+class TestGaugeLogger(object):
+    def setup(self):
+        self.base_logger = mock.Mock(name='BaseLogger')
+        self.now = 1000.0
+        self.logger = phlawg.GaugeLogger(
+            self.base_logger, epsilon=0.5, heartbeat=10, clock=lambda: self.now)
+
+    def emitted(self):
+        return [kw['extra']['value']
+                for args, kw in self.base_logger.info.call_args_list]
+
+    def test_first_value_emitted(self):
+        self.logger.info(depth=3)
+        tools.assert_equal([3], self.emitted())
+        self.base_logger.info.assert_called_once_with(
+            'depth=3', extra={'metric': 'depth', 'value': 3})
+
+    def test_unchanged_suppressed(self):
+        self.logger.info(depth=3)
+        self.now += 1
+        self.logger.info(depth=3)
+        self.logger.info(depth=3.5)
+        tools.assert_equal([3], self.emitted())
+
+    def test_changed_emitted(self):
+        self.logger.info(depth=3)
+        self.logger.info(depth=4)
+        # Compared against the last emitted value, not the last seen one.
+        self.logger.info(depth=4.25)
+        self.logger.info(depth=4.75)
+        tools.assert_equal([3, 4, 4.75], self.emitted())
+
+    def test_heartbeat(self):
+        self.logger.info(depth=3)
+        self.now += 9.9
+        self.logger.info(depth=3)
+        self.now += 0.1
+        self.logger.info(depth=3)
+        self.now += 5
+        self.logger.info(depth=3)
+        tools.assert_equal([3, 3], self.emitted())
+
+    def test_no_heartbeat(self):
+        self.logger.heartbeat = None
+        self.logger.info(depth=3)
+        self.now += 1e6
+        self.logger.info(depth=3)
+        tools.assert_equal([3], self.emitted())
+
+    def test_per_metric(self):
+        self.logger.info(depth=3, size=3)
+        self.logger.info(depth=3, size=7)
+        tools.assert_equal(
+            sorted([('depth', 3), ('size', 3), ('size', 7)]),
+            sorted((kw['extra']['metric'], kw['extra']['value'])
+                   for args, kw in self.base_logger.info.call_args_list))
+
+    def test_non_numeric(self):
+        self.logger.info(state='idle')
+        self.logger.info(state='idle')
+        self.logger.info(state='busy')
+        tools.assert_equal(['idle', 'busy'], self.emitted())
+
+    def test_log_method(self):
+        level = mock.Mock(name='LogLevel')
+        self.logger.log(level, depth=3)
+        self.logger.log(level, depth=3)
+        self.base_logger.log.assert_called_once_with(
+            level, 'depth=3', extra={'metric': 'depth', 'value': 3})
+
+    def test_disabled_level_not_remembered(self):
+        self.base_logger.isEnabledFor.side_effect = \
+                lambda level: level >= logging.INFO
+        self.logger.debug(depth=3)
+        tools.assert_equal(0, self.base_logger.debug.call_count)
+        self.logger.info(depth=3)
+        tools.assert_equal([3], self.emitted())
+        self.logger.log(logging.DEBUG, depth=4)
+        self.logger.log(logging.INFO, depth=4)
+        self.base_logger.log.assert_called_once_with(
+            logging.INFO, 'depth=4', extra={'metric': 'depth', 'value': 4})
+
+
+class TestLevelHandled(object):
+    def setup(self):
+        self.logger = logging.getLogger('phlawg.test.gauge.handled')
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+        self.handler = logging.NullHandler()
+        self.handler.setLevel(logging.INFO)
+
+    def teardown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(logging.NOTSET)
+        self.logger.propagate = True
+
+    def test_handler_levels(self):
+        self.logger.addHandler(self.handler)
+        tools.assert_false(phlawg.level_handled(self.logger, logging.DEBUG))
+        tools.assert_true(phlawg.level_handled(self.logger, logging.INFO))
+
+    def test_logger_level(self):
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.ERROR)
+        tools.assert_false(phlawg.level_handled(self.logger, logging.INFO))
+
+
+def test_configured_from_environment():
+    # phlawg's own configuration leaves metric loggers at DEBUG, with the level
+    # on the handler.
+    root = logging.getLogger()
+    root_handlers, root_level = list(root.handlers), root.level
+    metric_logger = logging.getLogger('gaugetest.metrics')
+    err = moves.StringIO()
+    environ = dict((k, v) for k, v in os.environ.items()
+                   if not k.startswith(config.ENVIRONMENT_PREFIX))
+    try:
+        with mock.patch.dict(os.environ, environ, clear=True):
+            with mock.patch('sys.stderr', err):
+                config.invalidate()
+                config.from_environment('gaugetest')
+                gauges = phlawg.GaugeLogger(metric_logger)
+                gauges.debug(depth=3)
+                gauges.info(depth=3)
+    finally:
+        config.invalidate()
+        for handler in list(metric_logger.handlers):
+            metric_logger.removeHandler(handler)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in root_handlers:
+            root.addHandler(handler)
+        root.setLevel(root_level)
+        metric_logger.propagate = True
+    tools.assert_equal(1, err.getvalue().count('depth=3'))
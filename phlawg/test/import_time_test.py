@@ -0,0 +1,73 @@
+"""
+Tracks the import cost of phlawg, as reported by ``python -X importtime``.
+
+Importing phlawg and configuring logging should stay cheap for short-lived
+processes; the JSON machinery is only loaded once a metric is formatted.
+"""
+import os
+import subprocess
+import sys
+
+from nose import tools
+from nose.plugins.skip import SkipTest
+
+import phlawg
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(phlawg.__file__)))
+
+DEFERRED_MODULES = ('json', 'logging.config', 'pythonjsonlogger', 'six')
+
+
+def run_python(code, *options):
+    env = dict(os.environ, PYTHONPATH=PACKAGE_ROOT)
+    for var in [var for var in env if var.startswith('PHLAWG_')]:
+        del env[var]
+    process = subprocess.Popen(
+        (sys.executable,) + options + ('-c', code),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    out, err = process.communicate()
+    tools.assert_equal(0, process.returncode, err)
+    return out.decode('utf-8'), err.decode('utf-8')
+
+
+def import_profile(code):
+    """Runs `code` under ``-X importtime`` and returns a dict of each imported
+    module's name to its cumulative import time in microseconds."""
+    if sys.version_info < (3, 7):
+        raise SkipTest('-X importtime requires python 3.7+')
+    _, err = run_python(code, '-X', 'importtime')
+    profile = {}
+    for line in err.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = [field.strip() for field in line.split(':', 1)[1].split('|')]
+        if fields[1].isdigit():
+            profile[fields[2]] = int(fields[1])
+    return profile
+
+
+def test_import_defers_modules():
+    profile = import_profile('import phlawg.config')
+    tools.assert_true('phlawg.config' in profile)
+    for module in DEFERRED_MODULES:
+        tools.assert_false(module in profile, module)
+
+
+def test_configuration_defers_json_formatter():
+    profile = import_profile(
+        'from phlawg import config; config.from_environment("app")')
+    tools.assert_false('pythonjsonlogger' in profile)
+
+
+def test_first_metric_loads_json_formatter():
+    out, err = run_python('\n'.join([
+        'import logging, sys',
+        'import phlawg',
+        'from phlawg import config',
+        'config.from_environment("app")',
+        'print("pythonjsonlogger" in sys.modules)',
+        'phlawg.get_metric_logger("app").info(hits=1)',
+        'print("pythonjsonlogger" in sys.modules)',
+        ]))
+    tools.assert_equal(['False', 'True'], out.split())
+    tools.assert_true('"metric": "hits"' in err, err)
@@ -0,0 +1,42 @@
+import logging
+
+from nose import tools
+import mock
+
+from phlawg import lazy
+
+
+class TestLazyFormatter(object):
+    def setup(self):
+        self.factory = mock.Mock(name='FormatterClass')
+        self.formatter = lazy.LazyFormatter(
+            self.factory, format='(message)', datefmt='%H')
+
+    def test_not_built_until_used(self):
+        tools.assert_equal(0, self.factory.call_count)
+
+    def test_builds_once(self):
+        record = mock.Mock(name='Record')
+        tools.assert_equal(
+            self.factory.return_value.format.return_value,
+            self.formatter.format(record))
+        self.formatter.format(record)
+        # "format" is passed along as "fmt", as dictConfig would.
+        self.factory.assert_called_once_with(fmt='(message)', datefmt='%H')
+        tools.assert_equal(
+            [mock.call(record), mock.call(record)],
+            self.factory.return_value.format.call_args_list)
+
+    def test_dotted_factory(self):
+        formatter = lazy.LazyFormatter(
+            'logging.Formatter', format='%(levelname)s %(message)s')
+        record = logging.makeLogRecord(
+            {'msg': 'hello', 'levelname': 'INFO'})
+        tools.assert_equal('INFO hello', formatter.format(record))
+        tools.assert_true(type(formatter.delegate()) is logging.Formatter)
+
+
+def test_resolve():
+    tools.assert_true(
+        lazy.resolve('logging.handlers.RotatingFileHandler')
+        is __import__('logging.handlers').handlers.RotatingFileHandler)
@@ -0,0 +1,146 @@
+import logging
+
+from nose import tools
+import mock
+from six import moves
+
+from phlawg import loadgen
+
+
+class CountingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TestReservoir(object):
+    def test_bounded(self):
+        reservoir = loadgen.Reservoir(10)
+        reservoir.extend(moves.xrange(1000))
+        tools.assert_equal(1000, reservoir.seen)
+        tools.assert_equal(10, len(reservoir.values))
+        tools.assert_true(set(reservoir.values) <= set(moves.xrange(1000)))
+
+    def test_small(self):
+        reservoir = loadgen.Reservoir(10)
+        reservoir.extend([3, 1, 2])
+        tools.assert_equal([3, 1, 2], reservoir.values)
+
+
+def test_generate():
+    metric_logger = mock.Mock(name='MetricLogger')
+    samples = loadgen.Reservoir(100)
+    names = loadgen.metric_names(3)
+    emitted = loadgen.generate(
+        metric_logger, logging.INFO, names, 'integer', 0, 50, None, samples,
+        seed=1)
+    tools.assert_equal(50, emitted)
+    tools.assert_equal(50, metric_logger.log.call_count)
+    tools.assert_equal(50, len(samples.values))
+    for args, kwargs in metric_logger.log.call_args_list:
+        tools.assert_equal((logging.INFO,), args)
+        tools.assert_equal(1, len(kwargs))
+        tools.assert_true(list(kwargs)[0] in names)
+
+
+def test_generate_deadline():
+    metric_logger = mock.Mock(name='MetricLogger')
+    emitted = loadgen.generate(
+        metric_logger, logging.INFO, ['m'], 'constant', 0, 0,
+        loadgen.time.time() - 1, loadgen.Reservoir(10))
+    tools.assert_equal(0, emitted)
+
+
+def test_percentiles():
+    tools.assert_equal('n/a', loadgen.percentiles([]))
+    tools.assert_equal(
+        'p50=2.0 p90=2.8 p99=3.0 p99.9=3.0 max=3.0',
+        loadgen.percentiles([3e-6, 1e-6, 2e-6]))
+
+
+@mock.patch('phlawg.config.from_environment')
+def test_main(from_environment):
+    logger = logging.getLogger('loadgentest.metrics')
+    handler = CountingHandler()
+    logger.addHandler(handler)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    out = moves.StringIO()
+    try:
+        tools.assert_equal(0, loadgen.main(
+            ['--threads', '2', '--count', '25', '--duration', '0',
+             '--cardinality', '4', 'loadgentest'], out=out))
+    finally:
+        logger.removeHandler(handler)
+    from_environment.assert_called_with('loadgentest')
+    tools.assert_equal(50, len(handler.records))
+    tools.assert_equal(
+        set('loadgen_%d' % i for i in range(4)),
+        set(record.metric for record in handler.records))
+    lines = out.getvalue().splitlines()
+    tools.assert_equal(3, len(lines))
+    tools.assert_true(lines[0].startswith('emitted: 50 metrics in '))
+    tools.assert_true(lines[1].startswith('emission latency (us): p50='))
+    tools.assert_true(lines[2].startswith('sink lag (us): p50='))
+    # The probe is removed afterward.
+    tools.assert_equal([], logger.handlers)
+
+
+def test_main_unknown_level():
+    with mock.patch('sys.stderr', moves.StringIO()):
+        tools.assert_raises(SystemExit, loadgen.main,
+                            ['--level', 'LOUD', '--count', '1'])
+
+
+def test_main_invalid_counts():
+    for name in ('--processes', '--threads', '--cardinality'):
+        with mock.patch('sys.stderr', moves.StringIO()):
+            tools.assert_raises(SystemExit, loadgen.main,
+                                [name, '0', '--count', '1'])
+
+
+@mock.patch('phlawg.config.from_environment')
+@mock.patch('phlawg.loadgen.generate', side_effect=ValueError('boom'))
+def test_main_failed_thread(generate, from_environment):
+    logger = logging.getLogger('loadgentest.metrics')
+    logger.propagate = False
+    out = moves.StringIO()
+    with mock.patch('sys.stderr', moves.StringIO()) as err:
+        tools.assert_equal(1, loadgen.main(
+            ['--threads', '2', '--count', '1', 'loadgentest'], out=out))
+    tools.assert_equal('', out.getvalue())
+    error = repr(ValueError('boom'))
+    tools.assert_equal(
+        'loadgen: thread 0 failed: %s; thread 1 failed: %s\n' % (error, error),
+        err.getvalue())
+
+
+class TestCollectResults(object):
+    def setup(self):
+        self.queue = moves.queue.Queue()
+        self.processes = [mock.Mock(exitcode=None), mock.Mock(exitcode=None)]
+
+    def test_collected(self):
+        self.queue.put({'emitted': 1})
+        self.queue.put({'emitted': 2})
+        tools.assert_equal(
+            [{'emitted': 1}, {'emitted': 2}],
+            loadgen.collect_results(self.processes, self.queue, 0.01))
+
+    def test_failed_worker(self):
+        self.queue.put({'emitted': 1})
+        self.processes[1].exitcode = 1
+        with tools.assert_raises(loadgen.WorkerError) as raised:
+            loadgen.collect_results(self.processes, self.queue, 0.01)
+        tools.assert_equal(
+            '1 of 2 worker processes failed (exit codes: 1)',
+            str(raised.exception))
+
+    @mock.patch('phlawg.loadgen.run', side_effect=loadgen.WorkerError('boom'))
+    def test_main_reports_failure(self, run):
+        with mock.patch('sys.stderr', moves.StringIO()) as err:
+            tools.assert_equal(1, loadgen.main(['--count', '1']))
+        tools.assert_equal('loadgen: boom\n', err.getvalue())
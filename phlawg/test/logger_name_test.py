@@ -1,8 +1,12 @@
+import logging
+import os
+
 from nose import tools
 import mock
 import six
 
 import phlawg
+from phlawg import config
 
 NAME_MAP = {
     # Empty name goes to "metrics"
@@ -38,3 +42,48 @@ class TestLoggerNames(object):
             expected,
             phlawg.to_metric_logger_name(logger))
 
+
+class TestMetricLoggerFactory(object):
+    def setup(self):
+        phlawg.clear_metric_logger_cache()
+
+    def test_wraps_metric_logger(self):
+        metric_logger = phlawg.get_metric_logger('factory.test')
+        tools.assert_true(isinstance(metric_logger, phlawg.MetricLogger))
+        tools.assert_equal(
+            logging.getLogger('factory.metrics.test'), metric_logger.logger)
+
+    def test_logger_argument(self):
+        tools.assert_equal(
+            'factory.metrics.test',
+            phlawg.get_metric_logger(logging.getLogger('factory.test')).logger.name)
+
+    def test_cached(self):
+        first = phlawg.get_metric_logger('factory.test')
+        with mock.patch('logging.getLogger') as get_logger:
+            with mock.patch('phlawg.to_metric_logger_name') as translate:
+                second = phlawg.get_metric_logger('factory.test')
+                by_logger = phlawg.get_metric_logger(
+                    logging.Logger('factory.test'))
+        tools.assert_equal(0, get_logger.call_count)
+        tools.assert_equal(0, translate.call_count)
+        tools.assert_true(first is second)
+        tools.assert_true(first is by_logger)
+
+    def test_bounded(self):
+        with mock.patch('phlawg.METRIC_LOGGER_CACHE_SIZE', 3):
+            for i in range(10):
+                phlawg.get_metric_logger('factory.bounded%d' % i)
+                tools.assert_true(len(phlawg._metric_loggers) <= 3)
+        # Entries from before the cache filled up are rebuilt when requested.
+        tools.assert_equal(
+            'factory.metrics.bounded0',
+            phlawg.get_metric_logger('factory.bounded0').logger.name)
+
+    def test_invalidated_on_reconfiguration(self):
+        first = phlawg.get_metric_logger('factory.test')
+        with mock.patch.dict(os.environ):
+            with mock.patch('logging.config.dictConfig'):
+                config.invalidate()
+                config.from_environment()
+        tools.assert_false(first is phlawg.get_metric_logger('factory.test'))
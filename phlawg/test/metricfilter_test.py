@@ -0,0 +1,230 @@
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+from nose import tools
+import mock
+
+import phlawg
+from phlawg import metricfilter
+
+
+class TestMetricFilter(object):
+    def setup(self):
+        self.filter = metricfilter.MetricFilter({
+            'app.metrics.db': False,
+            'app.metrics.db.query_ms': True,
+            'other.metrics': False,
+            })
+
+    def test_prefix_rules(self):
+        for logger_name, metric, expected in [
+                ('app.metrics', 'requests', True),
+                ('app.metrics', 'db', False),
+                ('app.metrics.db', 'rows', False),
+                ('app.metrics.db', 'query_ms', True),
+                ('app.metrics.dbx', 'rows', True),
+                ('other.metrics.sub', 'anything', False),
+                ('unrelated.metrics', 'db', True)]:
+            tools.assert_equal(
+                expected, self.filter.allows(logger_name, metric),
+                (logger_name, metric))
+
+    def test_table(self):
+        self.filter.allows('app.metrics.db', 'rows')
+        with mock.patch.object(self.filter, 'decide') as decide:
+            tools.assert_false(self.filter.allows('app.metrics.db', 'rows'))
+        tools.assert_equal(0, decide.call_count)
+
+    def test_rule_changes(self):
+        tools.assert_true(self.filter.allows('app.metrics', 'requests'))
+        self.filter.disable('app.metrics.requests')
+        tools.assert_false(self.filter.allows('app.metrics', 'requests'))
+        self.filter.enable('app.metrics.db')
+        tools.assert_true(self.filter.allows('app.metrics.db', 'rows'))
+        self.filter.clear()
+        tools.assert_true(self.filter.allows('other.metrics', 'x'))
+        self.filter.set_rules({'app': False})
+        tools.assert_false(self.filter.allows('app.metrics', 'requests'))
+
+    def test_table_bounded(self):
+        with mock.patch.object(metricfilter, 'TABLE_LIMIT', 5):
+            for i in range(20):
+                self.filter.allows('app.metrics', 'm%d' % i)
+                tools.assert_true(len(self.filter.table) <= 5)
+
+    def test_logging_filter(self):
+        def record(**kw):
+            return logging.makeLogRecord(dict(kw, name='app.metrics.db'))
+        tools.assert_false(self.filter.filter(record(metric='rows')))
+        tools.assert_true(self.filter.filter(record(metric='query_ms')))
+        tools.assert_true(self.filter.filter(record(msg='not a metric')))
+
+
+def test_parse_rules():
+    tools.assert_equal(
+        {'a.metrics.x': False, 'b.metrics': False, 'b.metrics.y': True},
+        metricfilter.parse_rules([
+            '# silence these\n',
+            'a.metrics.x\n',
+            '\n',
+            '-b.metrics   # noisy\n',
+            '+ b.metrics.y\n']))
+
+
+class TestRulesFile(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'metric-rules')
+        self.filter = metricfilter.MetricFilter()
+
+    def teardown(self):
+        self.filter.stop_watching()
+        shutil.rmtree(self.directory)
+
+    def write(self, text, mtime):
+        with open(self.path, 'w') as rules_file:
+            rules_file.write(text)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_load(self):
+        self.write('app.metrics.x\n', 1000)
+        self.filter.load(self.path)
+        tools.assert_equal({'app.metrics.x': False}, self.filter.rules)
+        os.unlink(self.path)
+        self.filter.load(self.path)
+        tools.assert_equal({}, self.filter.rules)
+
+    def test_check(self):
+        self.write('app.metrics.x\n', 1000)
+        self.filter.watch(self.path, interval=3600)
+        tools.assert_false(self.filter.allows('app.metrics', 'x'))
+        self.write('app.metrics.y\n', 2000)
+        self.filter.check()
+        tools.assert_true(self.filter.allows('app.metrics', 'x'))
+        tools.assert_false(self.filter.allows('app.metrics', 'y'))
+
+    def test_watch(self):
+        self.filter.watch(self.path, interval=0.01)
+        tools.assert_true(self.filter.allows('app.metrics', 'x'))
+        self.write('app.metrics.x\n', 1000)
+        deadline = time.time() + 5
+        while self.filter.allows('app.metrics', 'x') and time.time() < deadline:
+            time.sleep(0.01)
+        tools.assert_false(self.filter.allows('app.metrics', 'x'))
+
+    def test_watcher_restarted_in_child(self):
+        self.filter.watch(self.path, interval=3600)
+        watcher = self.filter.watcher
+        self.filter.after_fork_in_child()
+        tools.assert_false(watcher is self.filter.watcher)
+        tools.assert_true(self.filter.watcher.daemon)
+
+    def test_check_after_stop(self):
+        self.filter.watch(self.path, interval=3600)
+        self.filter.stop_watching()
+        # As a watcher thread still running at the time might.
+        self.filter.check()
+        self.write('app.metrics.x\n', 1000)
+        self.filter.check(self.path)
+        tools.assert_false(self.filter.allows('app.metrics', 'x'))
+
+    def wait_for_rules(self, rules):
+        deadline = time.time() + 5
+        while self.filter.rules != rules and time.time() < deadline:
+            time.sleep(0.01)
+        tools.assert_equal(rules, self.filter.rules)
+
+    def test_reload_on_signal(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            self.filter.reload_on_signal(self.path, signal.SIGUSR1)
+            tools.assert_equal({}, self.filter.rules)
+            self.write('app.metrics.x\n', 1000)
+            os.kill(os.getpid(), signal.SIGUSR1)
+            self.wait_for_rules({'app.metrics.x': False})
+            # A signal interrupting a rule change must not wait on its lock.
+            self.write('app.metrics.y\n', 2000)
+            handler = signal.getsignal(signal.SIGUSR1)
+            with self.filter.lock:
+                handler(signal.SIGUSR1, None)
+            self.wait_for_rules({'app.metrics.y': False})
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+
+    def test_reloader_restarted_in_child(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            self.filter.reload_on_signal(self.path, signal.SIGUSR1)
+            reloader = self.filter.reloader
+            self.filter.after_fork_in_child()
+            tools.assert_false(reloader is self.filter.reloader)
+            tools.assert_true(self.filter.reloader.daemon)
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+
+    def test_stop_watching(self):
+        self.filter.watch(self.path, interval=3600)
+        watcher = self.filter.watcher
+        self.filter.stop_watching()
+        watcher.join(5)
+        tools.assert_false(watcher.is_alive())
+        tools.assert_equal(None, self.filter.watcher)
+
+
+class TestMetricLoggerFiltering(object):
+    def setup(self):
+        self.base_logger = mock.Mock(name='BaseLogger')
+        self.base_logger.name = 'app.metrics'
+        self.filter = metricfilter.MetricFilter({'app.metrics.noisy': False})
+        phlawg.set_metric_filter(self.filter)
+
+    def teardown(self):
+        phlawg.set_metric_filter(None)
+
+    def test_level_methods(self):
+        logger = phlawg.MetricLogger(self.base_logger)
+        with mock.patch.object(logger, 'message', wraps=logger.message) as msg:
+            logger.info(noisy=1, quiet=2)
+        msg.assert_called_once_with('quiet', 2)
+        self.base_logger.info.assert_called_once_with(
+            'quiet=2', extra={'metric': 'quiet', 'value': 2})
+
+    def test_log(self):
+        logger = phlawg.MetricLogger(self.base_logger)
+        logger.log(logging.INFO, noisy=1)
+        tools.assert_equal(0, self.base_logger.log.call_count)
+
+    def test_uninstalled(self):
+        phlawg.set_metric_filter(None)
+        tools.assert_equal(None, phlawg.get_metric_filter())
+        phlawg.MetricLogger(self.base_logger).info(noisy=1)
+        tools.assert_equal(1, self.base_logger.info.call_count)
+
+    def test_gauge_logger(self):
+        logger = phlawg.GaugeLogger(self.base_logger)
+        logger.info(noisy=1)
+        self.filter.clear()
+        # The disabled emission did not count as emitted.
+        logger.info(noisy=1)
+        self.base_logger.info.assert_called_once_with(
+            'noisy=1', extra={'metric': 'noisy', 'value': 1})
+
+    def test_scope(self):
+        logger = phlawg.MetricLogger(self.base_logger)
+        with phlawg.MetricScope():
+            logger.info(noisy=1, quiet=2)
+        self.base_logger.info.assert_called_once_with(
+            'quiet=2', extra={'metrics': {'quiet': 2}, 'scope': {}})
+        with phlawg.MetricScope():
+            logger.info(noisy=1)
+        tools.assert_equal(1, self.base_logger.info.call_count)
+
+    def test_log_array(self):
+        logger = phlawg.MetricLogger(self.base_logger)
+        logger.log_array(logging.INFO, 'noisy', [1, 2, 3])
+        logger.log_array(logging.INFO, 'noisy', [1, 2, 3], summarize=False)
+        tools.assert_equal(0, self.base_logger.log.call_count)
@@ -0,0 +1,173 @@
+import logging
+import os
+import shutil
+import tempfile
+
+from nose import tools
+import mock
+from six import moves
+
+import phlawg
+from phlawg import prometheus
+
+
+def metric_record(name='app.metrics', **extra):
+    return logging.makeLogRecord(dict(
+        extra, name=name, levelno=logging.INFO, levelname='INFO'))
+
+
+def test_render():
+    tools.assert_equal(
+        '# HELP phlawg_metric_last Last value logged for the metric.\n'
+        '# TYPE phlawg_metric_last gauge\n'
+        'phlawg_metric_last{logger="app.metrics",metric="a",pid="5"} 2.5\n'
+        'phlawg_metric_last{logger="app.metrics",metric="b",pid="5"} +Inf\n'
+        '# HELP phlawg_metric_sum Sum of the values logged for the metric.\n'
+        '# TYPE phlawg_metric_sum gauge\n'
+        'phlawg_metric_sum{logger="app.metrics",metric="a",pid="5"} -4.0\n'
+        'phlawg_metric_sum{logger="app.metrics",metric="b",pid="5"} NaN\n'
+        '# HELP phlawg_metric_count_total Number of values logged for the metric.\n'
+        '# TYPE phlawg_metric_count_total counter\n'
+        'phlawg_metric_count_total{logger="app.metrics",metric="a",pid="5"} 2.0\n'
+        'phlawg_metric_count_total{logger="app.metrics",metric="b",pid="5"} 1.0\n',
+        prometheus.render([
+            (('app.metrics', 'b'), (float('inf'), float('nan'), 1)),
+            (('app.metrics', 'a'), (2.5, -4.0, 2))],
+            [('pid', '5')]))
+
+
+def test_no_collisions():
+    # Names that would collide if joined are told apart by their labels, and
+    # each family is declared once.
+    text = prometheus.render([
+        (('app.metrics', 'db_hits'), (1, 1, 1)),
+        (('app.metrics.db', 'hits'), (2, 2, 1)),
+        (('app.metrics', 'x_count'), (3, 3, 1)),
+        (('app.metrics', 'x'), (4, 4, 1))])
+    types = [line for line in text.splitlines() if line.startswith('# TYPE')]
+    tools.assert_equal(len(prometheus.FAMILIES), len(set(types)))
+    tools.assert_equal(len(prometheus.FAMILIES), len(types))
+    samples = [line.rsplit(' ', 1)[0] for line in text.splitlines()
+               if not line.startswith('#')]
+    tools.assert_equal(len(samples), len(set(samples)))
+    tools.assert_true(
+        'phlawg_metric_last{logger="app.metrics.db",metric="hits"}' in samples)
+
+
+def test_label_escaping():
+    tools.assert_equal(
+        '{metric="a\\"b\\\\c\\nd"}',
+        prometheus.format_labels([('metric', 'a"b\\c\nd')]))
+
+
+class TestPrometheusHandler(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'app.prom')
+        self.handler = prometheus.PrometheusHandler(self.path, interval=3600)
+
+    def teardown(self):
+        self.handler.close()
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with open(self.path) as textfile:
+            return textfile.read()
+
+    def test_state(self):
+        self.handler.handle(metric_record(metric='a', value=3))
+        self.handler.handle(metric_record(metric='a', value=-1))
+        self.handler.handle(metric_record(msg='not a metric'))
+        self.handler.handle(metric_record(metric='b', value='not a number'))
+        self.handler.handle(metric_record(metrics={'c': 1, 'd': 'x'}))
+        tools.assert_equal(
+            [(('app.metrics', 'a'), (-1.0, 2.0, 2)),
+             (('app.metrics', 'c'), (1.0, 1.0, 1))],
+            sorted(self.handler.snapshot()))
+
+    def test_array_summary(self):
+        logger = logging.getLogger('phlawg.test.prometheus')
+        logger.addHandler(self.handler)
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        try:
+            metric_logger = phlawg.MetricLogger(logger)
+            metric_logger.log_array(logging.INFO, 'a', [1, 2, 3])
+            metric_logger.info(a=4)
+        finally:
+            logger.removeHandler(self.handler)
+            logger.propagate = True
+            logger.setLevel(logging.NOTSET)
+        tools.assert_equal(
+            [(('phlawg.test.prometheus', 'a'), (4.0, 10.0, 4))],
+            self.handler.snapshot())
+
+    def test_write(self):
+        self.handler.handle(metric_record(metric='a', value=3))
+        self.handler.write()
+        tools.assert_equal(
+            prometheus.render(self.handler.snapshot()), self.read())
+        # Only the textfile itself is left behind.
+        tools.assert_equal(['app.prom'], os.listdir(self.directory))
+
+    def test_written_on_close(self):
+        self.handler.handle(metric_record(metric='a', value=3))
+        self.handler.close()
+        tools.assert_true(
+            'phlawg_metric_last{logger="app.metrics",metric="a"} 3.0\n'
+            in self.read())
+
+    def test_write_failure_keeps_old_file(self):
+        self.handler.handle(metric_record(metric='a', value=3))
+        self.handler.write()
+        before = self.read()
+        self.handler.handle(metric_record(metric='a', value=4))
+        with mock.patch('phlawg.prometheus._replace', side_effect=OSError):
+            tools.assert_raises(OSError, self.handler.write)
+        tools.assert_equal(before, self.read())
+        tools.assert_equal(['app.prom'], os.listdir(self.directory))
+
+    def test_after_fork_in_child(self):
+        self.handler.handle(metric_record(metric='a', value=3))
+        self.handler.after_fork_in_child()
+        tools.assert_equal([], self.handler.snapshot())
+        # The parent's textfile is not written by the child.
+        tools.assert_equal(None, self.handler.writer)
+        self.handler.close()
+        tools.assert_equal([], os.listdir(self.directory))
+
+
+def test_pid_path():
+    directory = tempfile.mkdtemp()
+    handler = prometheus.PrometheusHandler(
+        os.path.join(directory, 'app-{pid}.prom'), interval=3600)
+    try:
+        writer = handler.writer
+        with mock.patch('os.getpid', return_value=12345):
+            handler.after_fork_in_child()
+        tools.assert_false(writer is handler.writer)
+        tools.assert_true(handler.writer.daemon)
+        handler.handle(metric_record(metric='a', value=3))
+        handler.close()
+        with open(os.path.join(directory, 'app-12345.prom')) as textfile:
+            tools.assert_true(
+                'phlawg_metric_last{logger="app.metrics",metric="a",'
+                'pid="12345"} 3.0\n' in textfile.read())
+    finally:
+        handler.close()
+        shutil.rmtree(directory)
+
+
+def test_http():
+    handler = prometheus.PrometheusHandler(port=0)
+    try:
+        handler.handle(metric_record(metric='a', value=3))
+        response = moves.urllib.request.urlopen(
+            'http://127.0.0.1:%d/metrics' % handler.port)
+        tools.assert_equal(prometheus.CONTENT_TYPE,
+                           response.headers['Content-Type'])
+        tools.assert_equal(handler.exposition(),
+                           response.read().decode('utf-8'))
+        response.close()
+    finally:
+        handler.close()
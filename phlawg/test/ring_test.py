@@ -0,0 +1,273 @@
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from nose import tools
+import mock
+from six import moves
+
+from phlawg import collector
+from phlawg import ring
+
+
+class RingDirectory(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = ring.ring_path(self.directory, os.getpid())
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+
+class TestRing(RingDirectory):
+    def test_round_trip(self):
+        writer = ring.RingWriter(self.path, capacity=8)
+        tools.assert_true(writer.write(100.5, 'app.metrics', 'a', 20, 1.5, 7))
+        tools.assert_true(writer.write(101.0, 'app.metrics.db', 'a', 10, -2, 8))
+        reader = ring.RingReader(self.path)
+        tools.assert_equal(2, reader.pending())
+        tools.assert_equal(
+            [(100.5, 'app.metrics', 'a', 20, 1.5, os.getpid(), 7),
+             (101.0, 'app.metrics.db', 'a', 10, -2, os.getpid(), 8)],
+            [record.as_tuple() for record in reader.drain()])
+        tools.assert_equal(0, reader.pending())
+        tools.assert_equal([], reader.drain())
+        writer.close()
+        reader.close()
+
+    def test_value_types(self):
+        writer = ring.RingWriter(self.path, capacity=8)
+        for value in [1, 2.0, True, False, 2 ** 70]:
+            writer.write(100, 'app.metrics', 'a', 20, value)
+        values = [record.value for record in ring.RingReader(self.path).drain()]
+        tools.assert_equal([1, 2.0, True, False, float(2 ** 70)], values)
+        tools.assert_equal([int, float, bool, bool, float],
+                           [type(value) for value in values])
+
+    def test_created_complete(self):
+        # Nothing but the finished ring and its names file is left behind.
+        ring.RingWriter(self.path, capacity=8).close()
+        tools.assert_equal(
+            sorted([os.path.basename(self.path),
+                    os.path.basename(self.path) + ring.NAMES_SUFFIX]),
+            sorted(os.listdir(self.directory)))
+
+    def test_closed(self):
+        writer = ring.RingWriter(self.path, capacity=8)
+        reader = ring.RingReader(self.path)
+        tools.assert_false(reader.closed())
+        writer.close()
+        tools.assert_true(reader.closed())
+
+    def test_new_ring_path(self):
+        first = ring.new_ring_path(self.directory)
+        ring.RingWriter(first, capacity=2).close()
+        second = ring.new_ring_path(self.directory)
+        tools.assert_not_equal(first, second)
+        tools.assert_true(os.path.basename(second).startswith(
+            '%d-' % os.getpid()))
+
+    def test_names_interned(self):
+        writer = ring.RingWriter(self.path, capacity=8)
+        for i in range(3):
+            writer.write(100, 'app.metrics', 'a', 20, i)
+        writer.write(100, 'app.metrics', 'b', 20, 0)
+        writer.close()
+        with open(self.path + ring.NAMES_SUFFIX) as names:
+            tools.assert_equal(
+                ['0\tapp.metrics\ta\n', '1\tapp.metrics\tb\n'],
+                names.readlines())
+
+    def test_wraparound(self):
+        writer = ring.RingWriter(self.path, capacity=4)
+        reader = ring.RingReader(self.path)
+        values = []
+        for i in range(10):
+            writer.write(100, 'app.metrics', 'm%d' % (i % 3), 20, i)
+            if i % 3 == 2:
+                values.extend(record.value for record in reader.drain())
+        values.extend(record.value for record in reader.drain())
+        tools.assert_equal([float(i) for i in range(10)], values)
+        tools.assert_equal(0, reader.dropped())
+
+    def test_full_ring_drops(self):
+        writer = ring.RingWriter(self.path, capacity=2)
+        reader = ring.RingReader(self.path)
+        tools.assert_equal(
+            [True, True, False, False],
+            [writer.write(100, 'app.metrics', 'a', 20, i) for i in range(4)])
+        tools.assert_equal(2, reader.dropped())
+        tools.assert_equal([0.0], [r.value for r in reader.drain(limit=1)])
+        tools.assert_true(writer.write(100, 'app.metrics', 'a', 20, 4))
+        tools.assert_equal([1.0, 4.0], [r.value for r in reader.drain()])
+
+    def test_not_a_ring(self):
+        with open(self.path, 'wb') as not_ring:
+            not_ring.write(b'\0' * 128)
+        tools.assert_raises(ValueError, ring.RingReader, self.path)
+
+    def test_remove(self):
+        ring.RingWriter(self.path, capacity=2).close()
+        ring.RingReader(self.path).remove()
+        tools.assert_equal([], os.listdir(self.directory))
+
+
+def metric_record(name='app.metrics', **extra):
+    record = logging.makeLogRecord(dict(
+        extra, name=name, levelno=logging.INFO, levelname='INFO'))
+    record.created = 100.25
+    record.msecs = 250.0
+    record.thread = 5
+    return record
+
+
+class TestRingHandler(RingDirectory):
+    def setup(self):
+        super(TestRingHandler, self).setup()
+        self.handler = ring.RingHandler(self.directory, capacity=16)
+
+    def teardown(self):
+        self.handler.close()
+        super(TestRingHandler, self).teardown()
+
+    def drain(self):
+        reader = ring.RingReader(self.handler.writer.path)
+        try:
+            return [record.as_tuple() for record in reader.drain()]
+        finally:
+            reader.close()
+
+    def test_created_lazily(self):
+        tools.assert_equal([], os.listdir(self.directory))
+
+    def test_metric_records(self):
+        self.handler.handle(metric_record(metric='a', value=3))
+        self.handler.handle(metric_record(msg='not a metric'))
+        self.handler.handle(metric_record(metric='b', value='not a number'))
+        self.handler.handle(metric_record(metric='b', value='3'))
+        self.handler.handle(metric_record(metrics={'c': 1, 'd': 'x'}))
+        tools.assert_equal(
+            [(100.25, 'app.metrics', 'a', logging.INFO, 3, os.getpid(), 5),
+             (100.25, 'app.metrics', 'c', logging.INFO, 1, os.getpid(), 5)],
+            self.drain())
+
+    def test_creates_directory(self):
+        directory = os.path.join(self.directory, 'sub', 'rings')
+        handler = ring.RingHandler(directory, capacity=16)
+        try:
+            handler.handle(metric_record(metric='a', value=3))
+            tools.assert_equal([handler.writer.path],
+                               glob.glob(os.path.join(directory, '*.ring')))
+        finally:
+            handler.close()
+
+    def test_failure_reported_once(self):
+        not_directory = os.path.join(self.directory, 'file')
+        open(not_directory, 'w').close()
+        handler = ring.RingHandler(not_directory, capacity=16)
+        try:
+            with mock.patch.object(handler, 'handleError') as handle_error:
+                for value in range(3):
+                    handler.handle(metric_record(metric='a', value=value))
+            tools.assert_equal(1, handle_error.call_count)
+            tools.assert_equal(None, handler.writer)
+        finally:
+            handler.close()
+
+    def test_new_ring_after_fork(self):
+        self.handler.handle(metric_record(metric='a', value=3))
+        parent_writer = self.handler.writer
+        self.handler.after_fork_in_child()
+        with mock.patch('os.getpid', return_value=os.getpid() + 100000):
+            self.handler.handle(metric_record(metric='a', value=4))
+        tools.assert_false(parent_writer is self.handler.writer)
+        tools.assert_equal(
+            sorted([str(os.getpid()), str(os.getpid() + 100000)]),
+            sorted(name.split('-')[0] for name in os.listdir(self.directory)
+                   if name.endswith(ring.RING_SUFFIX)))
+        parent_writer.close()
+
+
+class TestCollector(RingDirectory):
+    def setup(self):
+        super(TestCollector, self).setup()
+        self.out = moves.StringIO()
+        self.collector = collector.Collector(
+            self.directory, self.out,
+            collector.metric_formatter())
+
+    def teardown(self):
+        self.collector.close()
+        super(TestCollector, self).teardown()
+
+    def lines(self):
+        return [json.loads(line) for line in self.out.getvalue().splitlines()]
+
+    def test_reconfigure_while_collecting(self):
+        first = ring.RingHandler(self.directory, capacity=16)
+        first.handle(metric_record(metric='requests', value=1))
+        self.collector.collect_once()
+        first.handle(metric_record(metric='latency_ms', value=250))
+        # Reconfiguring replaces the handler before the collector catches up.
+        first.close()
+        second = ring.RingHandler(self.directory, capacity=16)
+        second.handle(metric_record(metric='errors', value=7))
+        self.collector.collect_once()
+        second.close()
+        self.collector.collect_once()
+        tools.assert_equal(
+            ['requests=1', 'latency_ms=250', 'errors=7'],
+            [line['message'] for line in self.lines()])
+        # Closed rings are removed once drained.
+        tools.assert_equal([], os.listdir(self.directory))
+
+    def test_collect(self):
+        writer = ring.RingWriter(self.path, capacity=4)
+        writer.write(100.25, 'app.metrics', 'a', logging.INFO, 1.5, 9)
+        tools.assert_equal(1, self.collector.collect_once())
+        line, = self.lines()
+        tools.assert_equal(
+            {'name': 'app.metrics', 'levelname': 'INFO',
+             'process': os.getpid(), 'thread': 9, 'message': 'a=1.5',
+             'metric': 'a', 'value': 1.5},
+            dict((k, v) for k, v in line.items() if k != 'asctime'))
+        tools.assert_equal(
+            logging.Formatter().formatTime(metric_record()), line['asctime'])
+        # Still alive, so the ring is kept.
+        tools.assert_equal(0, self.collector.collect_once())
+        tools.assert_true(os.path.exists(self.path))
+        writer.close()
+
+    def test_removes_exited(self):
+        path = ring.ring_path(self.directory, 99999999)
+        writer = ring.RingWriter(path, capacity=4, pid=99999999)
+        writer.write(100.25, 'app.metrics', 'a', logging.INFO, 1.5, 9)
+        writer.close()
+        with mock.patch('phlawg.collector.process_exists', return_value=False):
+            tools.assert_equal(1, self.collector.collect_once())
+        tools.assert_equal([], os.listdir(self.directory))
+
+    def test_reports_drops(self):
+        writer = ring.RingWriter(self.path, capacity=1)
+        for i in range(3):
+            writer.write(100.25, 'app.metrics', 'a', logging.INFO, i, 9)
+        self.collector.collect_once()
+        self.collector.collect_once()
+        lines = self.lines()
+        tools.assert_equal(
+            [('app.metrics', 'a', 0.0),
+             (collector.COLLECTOR_LOGGER_NAME, 'dropped', 2)],
+            [(line['name'], line['metric'], line['value']) for line in lines])
+        writer.close()
+
+    def test_main(self):
+        writer = ring.RingWriter(self.path, capacity=4)
+        writer.write(100.25, 'app.metrics', 'a', logging.INFO, 1.5, 9)
+        out = moves.StringIO()
+        tools.assert_equal(
+            0, collector.main([self.directory, '--once'], out=out))
+        tools.assert_equal('a', json.loads(out.getvalue())['metric'])
+        writer.close()
@@ -0,0 +1,214 @@
+import threading
+
+from nose import tools
+from nose.plugins.skip import SkipTest
+import mock
+
+import phlawg
+from phlawg import scope
+
+
+class TestMetricScope(object):
+    def setup(self):
+        self.base_logger = mock.Mock(name='BaseLogger')
+        self.logger = phlawg.MetricLogger(self.base_logger)
+
+    def test_consolidates_at_exit(self):
+        with phlawg.MetricScope(endpoint='/users') as active:
+            tools.assert_equal(active, scope.current())
+            self.logger.info(a=1)
+            self.logger.info(b=2.5)
+            tools.assert_equal([], self.base_logger.info.call_args_list)
+        tools.assert_equal(None, scope.current())
+        self.base_logger.info.assert_called_once_with(
+            'a=1 b=2.5',
+            extra={'metrics': {'a': 1, 'b': 2.5},
+                   'scope': {'endpoint': '/users'}})
+
+    def test_accumulates_repeats(self):
+        with phlawg.MetricScope():
+            self.logger.info(hits=1, state='cold')
+            self.logger.info(hits=2, state='warm')
+        self.base_logger.info.assert_called_once_with(
+            'hits=3 state=warm',
+            extra={'metrics': {'hits': 3, 'state': 'warm'}, 'scope': {}})
+
+    def test_booleans_not_summed(self):
+        with phlawg.MetricScope():
+            self.logger.info(ok=True)
+            self.logger.info(ok=True)
+        self.base_logger.info.assert_called_once_with(
+            'ok=True', extra={'metrics': {'ok': True}, 'scope': {}})
+
+    def test_gauge_logger(self):
+        gauges = phlawg.GaugeLogger(self.base_logger, clock=lambda: 100.0)
+        gauges.info(queue_size=5)
+        with phlawg.MetricScope():
+            # Unchanged since emitted above, so suppressed.
+            gauges.info(queue_size=5)
+        tools.assert_equal(1, self.base_logger.info.call_count)
+        with phlawg.MetricScope():
+            for size in (6, 6, 7, 7):
+                gauges.info(queue_size=size)
+        self.base_logger.info.assert_called_with(
+            'queue_size=7', extra={'metrics': {'queue_size': 7}, 'scope': {}})
+
+    def test_one_record_per_level(self):
+        level = mock.Mock(name='LogLevel')
+        with phlawg.MetricScope():
+            self.logger.info(a=1)
+            self.logger.debug(b=2)
+            self.logger.log(level, c=3)
+            self.logger.log(level, d=4)
+        self.base_logger.info.assert_called_once_with(
+            'a=1', extra={'metrics': {'a': 1}, 'scope': {}})
+        self.base_logger.debug.assert_called_once_with(
+            'b=2', extra={'metrics': {'b': 2}, 'scope': {}})
+        self.base_logger.log.assert_called_once_with(
+            level, 'c=3 d=4', extra={'metrics': {'c': 3, 'd': 4}, 'scope': {}})
+
+    def test_nothing_captured(self):
+        with phlawg.MetricScope():
+            pass
+        tools.assert_equal([], self.base_logger.method_calls)
+
+    def test_nested(self):
+        with phlawg.MetricScope(depth='outer'):
+            self.logger.info(a=1)
+            with phlawg.MetricScope(depth='inner'):
+                self.logger.info(b=2)
+            self.logger.info(c=3)
+        tools.assert_equal(
+            [mock.call('b=2', extra={'metrics': {'b': 2},
+                                     'scope': {'depth': 'inner'}}),
+             mock.call('a=1 c=3', extra={'metrics': {'a': 1, 'c': 3},
+                                         'scope': {'depth': 'outer'}})],
+            self.base_logger.info.call_args_list)
+
+    def test_decorator(self):
+        @phlawg.MetricScope(job='reindex')
+        def work(value):
+            self.logger.info(items=value)
+            return value
+
+        tools.assert_equal(5, work(5))
+        tools.assert_equal(7, work(7))
+        tools.assert_equal(
+            [mock.call('items=5', extra={'metrics': {'items': 5},
+                                         'scope': {'job': 'reindex'}}),
+             mock.call('items=7', extra={'metrics': {'items': 7},
+                                         'scope': {'job': 'reindex'}})],
+            self.base_logger.info.call_args_list)
+
+    def test_emits_on_exception(self):
+        try:
+            with phlawg.MetricScope():
+                self.logger.info(a=1)
+                raise ValueError()
+        except ValueError:
+            pass
+        tools.assert_equal(1, self.base_logger.info.call_count)
+
+    def test_thread_isolation(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def other_thread():
+            self.logger.info(unscoped=1)
+            started.set()
+            release.wait()
+
+        with phlawg.MetricScope():
+            thread = threading.Thread(target=other_thread)
+            thread.start()
+            started.wait()
+            self.logger.info(scoped=1)
+            release.set()
+            thread.join()
+        tools.assert_equal(
+            [mock.call('unscoped=1',
+                       extra={'metric': 'unscoped', 'value': 1}),
+             mock.call('scoped=1',
+                       extra={'metrics': {'scoped': 1}, 'scope': {}})],
+            self.base_logger.info.call_args_list)
+
+    def test_reused_concurrently(self):
+        shared = phlawg.MetricScope(job='shared')
+        entered = threading.Event()
+        other_done = threading.Event()
+
+        def first():
+            with shared:
+                self.logger.info(a=1)
+                entered.set()
+                other_done.wait(5)
+                self.logger.info(a=1)
+
+        def second():
+            entered.wait(5)
+            with shared:
+                self.logger.info(b=1)
+            other_done.set()
+
+        threads = [threading.Thread(target=first),
+                   threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        tools.assert_equal(
+            [mock.call('b=1', extra={'metrics': {'b': 1},
+                                     'scope': {'job': 'shared'}}),
+             mock.call('a=2', extra={'metrics': {'a': 2},
+                                     'scope': {'job': 'shared'}})],
+            self.base_logger.info.call_args_list)
+
+    def test_reused_sequentially(self):
+        shared = phlawg.MetricScope()
+        for value in (1, 2):
+            with shared as active:
+                tools.assert_false(active is shared)
+                self.logger.info(a=value)
+        tools.assert_equal(
+            [mock.call('a=1', extra={'metrics': {'a': 1}, 'scope': {}}),
+             mock.call('a=2', extra={'metrics': {'a': 2}, 'scope': {}})],
+            self.base_logger.info.call_args_list)
+
+    def test_capture_after_exit(self):
+        with phlawg.MetricScope() as active:
+            self.logger.info(a=1)
+        tools.assert_false(active.capture(self.logger, self.base_logger.info,
+                                          (), {'late': 1}))
+
+    def test_outliving_context(self):
+        # As with an asyncio task created within the scope, finishing after it.
+        if scope.contextvars is None:
+            raise SkipTest('contextvars unavailable')
+        with phlawg.MetricScope():
+            context = scope.contextvars.copy_context()
+            self.logger.info(a=1)
+        context.run(self.logger.info, late=1)
+        tools.assert_equal(
+            [mock.call('a=1', extra={'metrics': {'a': 1}, 'scope': {}}),
+             mock.call('late=1', extra={'metric': 'late', 'value': 1})],
+            self.base_logger.info.call_args_list)
+
+    def test_context_isolation(self):
+        # Each asyncio task runs in a copy of the context it was created in.
+        if scope.contextvars is None:
+            raise SkipTest('contextvars unavailable')
+
+        def task(name):
+            with phlawg.MetricScope(task=name):
+                self.logger.info(**{name: 1})
+                self.logger.info(**{name: 1})
+
+        with phlawg.MetricScope(task='parent'):
+            scope.contextvars.copy_context().run(task, 'a')
+            self.logger.info(parent=1)
+        tools.assert_equal(
+            [mock.call('a=2', extra={'metrics': {'a': 2},
+                                     'scope': {'task': 'a'}}),
+             mock.call('parent=1', extra={'metrics': {'parent': 1},
+                                          'scope': {'task': 'parent'}})],
+            self.base_logger.info.call_args_list)